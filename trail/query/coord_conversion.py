@@ -5,8 +5,9 @@ def equatorial_to_unitsphere(ra, dec):
     """
     Convert ra and dec in radian from equtorial coordinate into cartesian coordinates.
     """
-    x = np.cos(dec) * np.cos(ra)
-    y = np.cos(dec) * np.sin(ra)
+    cosDec = np.cos(dec)
+    x = cosDec * np.cos(ra)
+    y = cosDec * np.sin(ra)
     z = np.sin(dec)
 
     return {"x": x, "y": y, "z": z}
@@ -65,6 +65,13 @@ if "gallery_image_count" in siteConfig:
 else:
     GALLERY_IMAGE_COUNT = 12
 
+# Number of CCDs processed concurrently when creating focal plane thumbnails,
+# None lets the processors pick based on the number of CPUs.
+if "thumbnail_workers" in siteConfig:
+    THUMBNAIL_WORKERS = siteConfig.thumbnail_workers
+else:
+    THUMBNAIL_WORKERS = None
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.1/howto/deployment/checklist/
@@ -5,6 +5,7 @@ support working with the data.
 
 
 import os
+import operator
 from dataclasses import dataclass, field
 from typing import Sequence
 
@@ -20,6 +21,26 @@ import numpy as np
 __all__ = ["UploadInfo", "Metadata", "Wcs", "StandardizedHeader"]
 
 
+def attrs_getter(names):
+    """Returns a callable that fetches the named attributes of an object as a
+    tuple, in a single call.
+
+    Parameters
+    ----------
+    names : `tuple[str]`
+        Names of the attributes.
+
+    Returns
+    -------
+    getter : `callable`
+        Callable returning a tuple of attribute values of the given object.
+    """
+    if len(names) > 1:
+        return operator.attrgetter(*names)
+    # attrgetter does not return a tuple for a single attribute
+    return lambda obj: tuple(getattr(obj, name) for name in names)
+
+
 def set_keys_from_columns(cls):
     """Read the model schema and add fields, that are not a relationship or an
     auto-generated field, to class attribute `keys`.
@@ -31,22 +52,23 @@ def set_keys_from_columns(cls):
     cls : `class`
         Class to inspect and modify.
     """
-    # This is quite hacky, but I honestly could not find a different way and
-    # have Django not complain about un-initialized models, or completely
-    # breaking down the models __init__ method...
     if cls.keys or cls.required_keys:
         return  # this should really perhaps be an error?
 
-    columns = [column for column in cls._meta.get_fields()]
+    # Only the model's own concrete fields are inspected, these are known as
+    # soon as the class is created, so the keys can be set at import time,
+    # before the app registry is ready, instead of on every instantiation.
     names, required = [], []
-    for col in columns:
+    for col in cls._meta.local_fields:
         if not col.auto_created and not col.is_relation:
             names.append(col.name)
             if not col.null:
                 required.append(col.name)
 
-    cls.keys = names
-    cls.required_keys = required
+    cls.keys = tuple(names)
+    cls.required_keys = tuple(required)
+    cls._exactEqualityKeys = tuple(name for name in names if name not in cls._closeEqualityKeys)
+    cls._keysGetter = staticmethod(attrs_getter(cls.keys))
 
 
 def dataToComponent(data, component):
@@ -85,14 +107,24 @@ class StandardizedKeysMixin:
     """Mix-in class for standardized output data classes.
     """
 
-    keys = []
+    keys = ()
     """All standardized keys expected as output of processing."""
 
-    required_keys = []
+    required_keys = ()
     """Standardized keys that must exist if the result is to be recorded in the
     database.
     """
 
+    _closeEqualityKeys = ()
+    """Standardized keys that are tested only in approximate equality."""
+
+    _exactEqualityKeys = ()
+    """Standardized keys that are tested in exact equality, all `keys` not in
+    `_closeEqualityKeys`."""
+
+    _keysGetter = staticmethod(attrs_getter(()))
+    """Fetches the values of all `keys` of an instance, see `attrs_getter`."""
+
     @classmethod
     def fromDictSubset(cls, data):
         """Create an instance from, potentially a subset of, dictionary
@@ -109,17 +141,26 @@ class StandardizedKeysMixin:
         instance : `object`
             Instance created from given data.
         """
-        dictSubset = {key: data.get(key, None) for key in cls.keys}
-        return cls(**dictSubset)
+        return cls(**{key: data.get(key) for key in cls.keys})
 
     def values(self):
         """Returns a list of `keys` values."""
-        return [getattr(self, key) for key in self.keys]
+        return list(self._keysGetter(self))
 
     def toDict(self):
         """Returns a dictionary of `keys` names and values."""
         # asdict use here would be nice, but is much slower...
-        return {key: getattr(self, key) for key in self.keys}
+        return dict(zip(self.keys, self._keysGetter(self)))
+
+    def _closeEqualityValues(self):
+        """Returns the values of `_closeEqualityKeys` as an array of floats.
+        Values that are not set, i.e. `None`, are returned as NaN.
+        """
+        # when a value is None (not set) the equality still might hold
+        # despite the fact the object is not valid but np will complain
+        # about implicit casting, so the array is built as float explicitly
+        return np.fromiter((getattr(self, key) for key in self._closeEqualityKeys),
+                           dtype=float, count=len(self._closeEqualityKeys))
 
 
 class Metadata(models.Model, StandardizedKeysMixin):
@@ -127,7 +168,7 @@ class Metadata(models.Model, StandardizedKeysMixin):
     A single upload can have many associated metadata entries.
     """
 
-    _closeEqualityKeys = ['obs_lon', 'obs_lat', 'obs_height']
+    _closeEqualityKeys = ('obs_lon', 'obs_lat', 'obs_height')
     """Standardized keys that are tested only in approximate equality."""
 
     # This will need to be fixed, cascading can orphan metadata entries
@@ -152,10 +193,6 @@ class Metadata(models.Model, StandardizedKeysMixin):
     exposure_duration = models.FloatField("exposure time (s)", null=True)
     filter_name = models.CharField("filter name", max_length=30, null=True)
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        set_keys_from_columns(self.__class__)
-
     def isClose(self, other, **kwargs):
         """Tests approximate equality between objects.
 
@@ -176,23 +213,12 @@ class Metadata(models.Model, StandardizedKeysMixin):
         Only values in `_closeEqualityKeys` will be tested approximately, the
         rest will be matched exactly.
         """
-        exactlyMatched = list(set(self.keys) - set(self._closeEqualityKeys))
-        areEqual = all([getattr(self, key) == getattr(other, key) for key in exactlyMatched])
-
-        # when a value is None (not set) the equality still might hold
-        # despite the fact the object is not valid but np will complain
-        # about implicit casting, so we need to do it explicitly, luckily
-        # all the vals are floats, but performance-wise it's better to fail?
-        slfVals = [getattr(self, key) for key in self._closeEqualityKeys]
-        othVals = [getattr(other, key) for key in other._closeEqualityKeys]
-        try:
-            areClose = np.allclose(slfVals, othVals, **kwargs)
-        except TypeError:
-            slfVals = np.array(slfVals, dtype=float)
-            othVals = np.array(othVals, dtype=float)
-            areClose = np.allclose(slfVals, othVals, **kwargs)
+        # cheap exact comparisons first, stopping at the first mismatch
+        if not all(getattr(self, key) == getattr(other, key) for key in self._exactEqualityKeys):
+            return False
 
-        return areEqual and areClose
+        return np.allclose(self._closeEqualityValues(),
+                           other._closeEqualityValues(), **kwargs)
 
     @classmethod
     def query_sky_region(cls, bboxDict, queryset=None):
@@ -270,9 +296,9 @@ class Wcs(models.Model, StandardizedKeysMixin):
     entry.
     """
 
-    _closeEqualityKeys = ['radius', 'center_x', 'center_y',
+    _closeEqualityKeys = ('radius', 'center_x', 'center_y',
                           'center_z', 'corner_x', 'corner_y',
-                          'corner_z']
+                          'corner_z')
     """Standardized keys that are tested only in approximate equality."""
 
     # same as above, cascading can orphan WCS entries
@@ -288,10 +314,6 @@ class Wcs(models.Model, StandardizedKeysMixin):
     corner_y = models.FloatField("unit sphere coordinate of corner pixel")
     corner_z = models.FloatField("unit sphere coordinate of corner pixel")
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        set_keys_from_columns(self.__class__)
-
     def isClose(self, other, **kwargs):
         """Tests approximate equality between objects.
 
@@ -312,13 +334,8 @@ class Wcs(models.Model, StandardizedKeysMixin):
         Only values in `_closeEqualityKeys` will be tested approximately, the
         rest will be matched exactly. For Wcs, these are keys.
         """
-        try:
-            return np.allclose(self.values(), other.values(), **kwargs)
-        except TypeError:
-            # same problem as in Metadata isClose
-            slfVals = np.array(self.values(), dtype=float)
-            othVals = np.array(other.values(), dtype=float)
-            return np.allclose(slfVals, othVals, **kwargs)
+        return np.allclose(self._closeEqualityValues(),
+                           other._closeEqualityValues(), **kwargs)
 
 
 class Thumbnails(models.Model, StandardizedKeysMixin):
@@ -419,6 +436,10 @@ class Thumbnails(models.Model, StandardizedKeysMixin):
         return Image.open(path)
 
 
+for model in (Metadata, Wcs, Thumbnails):
+    set_keys_from_columns(model)
+
+
 @dataclass
 class StandardizedHeader:
     """A dataclass that associates standardized metadata with one or more
@@ -450,23 +471,20 @@ class StandardizedHeader:
             `Metadata` and `Wcs`.
         """
         meta, wcs = None, []
-        if "metadata" in data and "wcs" in data:
-            meta = Metadata(**data["metadata"])
+        metadata, wcsData = data.get("metadata"), data.get("wcs")
+        if metadata is not None and wcsData is not None:
+            meta = Metadata(**metadata)
 
             # sometimes multiExt Fits have only 1 valid image extension
             # otherwise we expect a list.
-            if isinstance(data["wcs"], dict):
-                wcs.append(Wcs(metadata=meta, **data["wcs"]))
+            if isinstance(wcsData, dict):
+                wcs.append(Wcs(metadata=meta, **wcsData))
             else:
-                for ext in data["wcs"]:
-                    wcs.append(Wcs(metadata=meta, **ext))
+                wcs = [Wcs(metadata=meta, **ext) for ext in wcsData]
         else:
             meta = Metadata.fromDictSubset(data)
-            wcs = Wcs.fromDictSubset(data)
-            wcs.metadata = meta
-
-        if type(wcs) != list:
-            wcs = [wcs, ]
+            wcs = [Wcs.fromDictSubset(data), ]
+            wcs[0].metadata = meta
 
         return cls(metadata=meta, wcs=wcs)
 
@@ -537,21 +555,25 @@ class StandardizedHeader:
         if len(self.wcs) != len(other.wcs):
             return False
 
-        areClose = self.metadata.isClose(other.metadata, **kwargs)
-        for thisWcs, otherWcs in zip(self.wcs, other.wcs):
-            areClose = areClose and thisWcs.isClose(otherWcs, **kwargs)
+        if not self.metadata.isClose(other.metadata, **kwargs):
+            return False
+
+        if not self.wcs:
+            return True
 
-        return areClose
+        # compare all of the WCS, one per row, in a single call; equivalent
+        # to testing each pair with Wcs.isClose
+        thisWcs = np.stack([wcs._closeEqualityValues() for wcs in self.wcs])
+        otherWcs = np.stack([wcs._closeEqualityValues() for wcs in other.wcs])
+        return np.allclose(thisWcs, otherWcs, **kwargs)
 
     def toDict(self):
         """Returns a dictionary of standardized metadata and wcs values."""
         if self.isMultiExt:
-            wcsDicts = {"wcs": [wcs.toDict() for wcs in self.wcs]}
+            wcs = [wcs.toDict() for wcs in self.wcs]
         else:
-            wcsDicts = {"wcs": self.wcs[0].toDict()}
-        metadataDict = {"metadata": self.metadata.toDict()}
-        metadataDict.update(wcsDicts)
-        return metadataDict
+            wcs = self.wcs[0].toDict()
+        return {"metadata": self.metadata.toDict(), "wcs": wcs}
 
 
 @dataclass
@@ -559,7 +581,7 @@ class StandardizedResult:
     """A dataclass that associates standardized header metadata with one or
     more standardized WCS and their thumbnails.
     """
-    _thumbkeys = ["thumbnails", "thumbs", "thumbnail", "thumb"]
+    _thumbkeys = ("thumbnails", "thumbs", "thumbnail", "thumb")
     header: StandardizedHeader = None
     thumbnails: Sequence[Thumbnails] = field(default_factory=list)
 
@@ -654,7 +676,7 @@ class StandardizedResult:
     @property
     def isMultiExt(self):
         """True when the header is a multi extension header."""
-        return len(self.wcs) > 1
+        return self.header.isMultiExt
 
     def appendThumbnail(self, thumbnail):
         """Append a Thumbnail to the end of the thumbnails list.
@@ -684,9 +706,8 @@ class StandardizedResult:
         """Returns a dictionary of standardized metadata, wcs an thumbnails."""
         metadataDict = self.header.toDict()
         if self.isMultiExt:
-            thumbDicts = {"thumbnails": [thumb.toDict() for thumb in self.thumbnails]}
+            metadataDict["thumbnails"] = [thumb.toDict() for thumb in self.thumbnails]
         else:
-            thumbDicts = {"thumbnails": {"large": self.thumbnails[0].large,
-                                         "small": self.thumbnails[0].small}}
-        metadataDict.update(thumbDicts)
+            metadataDict["thumbnails"] = {"large": self.thumbnails[0].large,
+                                          "small": self.thumbnails[0].small}
         return metadataDict
@@ -8,14 +8,12 @@ from abc import abstractmethod
 
 import numpy as np
 from PIL import Image
-import matplotlib.pyplot as plt
-import astropy.visualization as aviz
 from astropy.io import fits
-from django.db import transaction
+from django.db import connection, transaction
 
 from upload.process_uploads.upload_processor import UploadProcessor
 from upload.process_uploads.header_standardizer import HeaderStandardizer
-from upload.models import StandardizedHeader, StandardizedResult, Thumbnails
+from upload.models import StandardizedHeader, StandardizedResult, Thumbnails, Wcs
 
 
 __all__ = ["FitsProcessor", ]
@@ -67,15 +65,65 @@ class FitsProcessor(UploadProcessor):
     extensions = [".fit", ".fits", ".fits.fz"]
     """File extensions this processor can handle."""
 
+    thumbnailLut = np.interp(np.linspace(0, 1, 256), np.linspace(0, 1, 9),
+                             [255, 240, 217, 189, 150, 115, 82, 37, 0]).round().astype(np.uint8)
+    """Lookup table mapping thumbnail intensities to the saved gray levels,
+    the (inverted) ColorBrewer "Greys" colormap."""
+
+    histEqSampleSize = 250_000
+    """Approximate number of pixels sampled to build the histogram
+    equalization CDF in `_histogramEqualize`."""
+
+    histEqBins = 4096
+    """Number of histogram bins used to build the histogram equalization CDF
+    in `_histogramEqualize`."""
+
     def __init__(self, uploadInfo, uploadedFile):
         super().__init__(uploadInfo, uploadedFile)
-        self.hdulist = fits.open(uploadedFile.tmpfile.temporary_file_path())
+        self.hdulist = self._openFits(uploadedFile)
         self.primary = self.hdulist["PRIMARY"].header
         self.standardizer = HeaderStandardizer.fromHeader(self.primary,
                                                           filename=uploadedFile.filename,
-                                                          filepath=uploadedFile.tmpfile.temporary_file_path())
+                                                          filepath=uploadedFile.filepath)
         self.isMultiExt = len(self.hdulist) > 1
 
+    @staticmethod
+    def _openFits(uploadedFile):
+        """Opens the uploaded FITS file, or returns the already opened one.
+
+        Every processor probing the upload in `canProcess`, and the one
+        finally processing it, inspect the same headers. The file is opened
+        once and the `HDUList` is kept on the uploaded file for reuse.
+
+        Parameters
+        ----------
+        uploadedFile : `upload_wrapper.TemporaryUploadedFileWrapper`
+            Uploaded file.
+
+        Returns
+        -------
+        hdulist : `astropy.io.fits.HDUList`
+            All HDUs found in the FITS file.
+
+        Raises
+        ------
+        OSError
+            File is corrupted or isn't a FITS file.
+        """
+        hdulist = uploadedFile.hdulist
+        if hdulist is None:
+            # only the headers are parsed here, image data is read when, and
+            # if, accessed. Astropy memory maps unscaled data by default, but
+            # forcing it with memmap=True refuses to load BZERO/BSCALE/BLANK
+            # scaled data, i.e. every unsigned 16bit image.
+            hdulist = fits.open(uploadedFile.source, lazy_load_hdus=True)
+            uploadedFile.hdulist = hdulist
+        return hdulist
+
+    def close(self):
+        """Closes the FITS file and releases any memory mapped image data."""
+        self.uploadedFile.close()
+
     @staticmethod
     def _isMultiExtFits(hdulist):
         """Returns `True` when given HDUList contains more than 1 HDU.
@@ -87,6 +135,111 @@ class FitsProcessor(UploadProcessor):
         """
         return len(hdulist) > 1
 
+    @staticmethod
+    def _resize(img, size):
+        """Resizes the image to the given size.
+
+        Downscaling, the common case for thumbnails, averages the pixels under
+        the footprint of each output pixel (box filter), which is much cheaper
+        than a Lanczos filter and indistinguishable at thumbnail scales. Large
+        reductions are first done in integer steps (`PIL.Image.reduce`), and
+        only the remainder is resampled. Upscaling uses the Lanczos filter.
+
+        Parameters
+        ----------
+        img : `PIL.Image.Image`
+            Image.
+        size : `tuple[int, int]`
+            Requested size, as a (width, height) tuple.
+
+        Returns
+        -------
+        resized : `PIL.Image.Image`
+            Resized image.
+        """
+        if size[0] <= img.size[0] and size[1] <= img.size[1]:
+            return img.resize(size, Image.BOX, reducing_gap=2.0)
+        return img.resize(size, Image.LANCZOS)
+
+    @staticmethod
+    def _blockMean(image, factor):
+        """Downsamples an 8bit image by an integer factor by averaging
+        non-overlapping ``factor x factor`` blocks of pixels.
+
+        Rows and columns that don't fill a whole block are discarded.
+
+        Parameters
+        ----------
+        image : `np.array`
+            2D image of unsigned 8bit integers.
+        factor : `int`
+            Downsampling factor.
+
+        Returns
+        -------
+        downsampled : `np.array`
+            Downsampled image.
+        """
+        nRows, nCols = image.shape[0]//factor, image.shape[1]//factor
+        blocks = image[:nRows*factor, :nCols*factor].reshape(nRows, factor, nCols, factor)
+        sums = blocks.sum(axis=(1, 3), dtype=np.uint32)
+        return ((sums + factor**2//2) // factor**2).astype(np.uint8)
+
+    @classmethod
+    def _histogramEqualize(cls, image, maxValue=1.0, dtype=np.float32, out=None):
+        """Histogram equalizes the image, mapping it onto the
+        [0, ``maxValue``] domain.
+
+        Parameters
+        ----------
+        image : `np.array`
+            Image.
+        maxValue : `float`, optional
+            Value the brightest pixels are mapped to.
+        dtype : `type`, optional
+            Data type of the returned image.
+        out : `np.array`, optional
+            Array of the same shape as the image, and of ``dtype``, the
+            equalized image is written to. A new array is allocated if not
+            given. The input image is never modified.
+
+        Returns
+        -------
+        equalized : `np.array`
+            Equalized image.
+
+        Notes
+        -----
+        Non-finite pixels don't contribute to the CDF. NaN and negative
+        infinity map to the level of the darkest pixels and positive infinity
+        to the level of the brightest ones.
+        """
+        image = np.asarray(image)
+        vmin, vmax = image.min(), image.max()
+        if not (np.isfinite(vmin) and np.isfinite(vmax)):
+            finite = image[np.isfinite(image)]
+            vmin, vmax = (finite.min(), finite.max()) if finite.size else (0, 0)
+
+        # The CDF is smooth, so building it from a strided subsample instead
+        # of every pixel is visually indistinguishable on thumbnails.
+        stride = max(1, image.size // cls.histEqSampleSize)
+        hist, _ = np.histogram(image.ravel()[::stride], bins=cls.histEqBins,
+                               range=(vmin, vmax))
+        # value at the middle of each bin, already scaled to the target range
+        # and type, so that applying it is a single lookup
+        cdf = (np.cumsum(hist) - hist/2) / max(hist.sum(), 1)
+        lut = (cdf * maxValue).astype(dtype)
+
+        # Bin every pixel with one float32 scratch array, that is then
+        # reused as the index into the LUT.
+        scale = cls.histEqBins / (float(vmax) - float(vmin)) if vmax > vmin else 1
+        binIdx = np.subtract(image, vmin, dtype=np.float32)
+        np.multiply(binIdx, scale, out=binIdx)
+        np.nan_to_num(binIdx, copy=False, nan=0, posinf=cls.histEqBins - 1, neginf=0)
+        np.clip(binIdx, 0, cls.histEqBins - 1, out=binIdx)
+        # indices are already clipped, mode="clip" also avoids buffering out
+        return np.take(lut, binIdx.astype(np.uint16), out=out, mode="clip")
+
     @classmethod
     def normalizeImage(cls, image):
         """Normalizes the image data to the [0,1] domain, using histogram
@@ -104,10 +257,9 @@ class FitsProcessor(UploadProcessor):
         """
         # TODO: make things like these configurable (also see resize in
         # store_thumbnail)
-        stretch = aviz.HistEqStretch(image)
-        norm = aviz.ImageNormalize(image, stretch=stretch, clip=True)
-
-        return norm(image)
+        # single precision is plenty for display and halves the memory
+        # traffic
+        return cls._histogramEqualize(image, 1.0, np.float32)
 
     @classmethod
     def _createThumbnails(cls, filename, image, basewidth=640):
@@ -132,26 +284,47 @@ class FitsProcessor(UploadProcessor):
             Dictionary containing the save location of the thumbnail,
             `savepath`, and the image, `thumb`.
         """
-        normedImage = cls.normalizeImage(image)
+        # equalize straight into [0, 255] uint8, without float intermediates
+        normedImage = cls._histogramEqualize(image, 255, np.uint8)
 
         # TODO: a note to fix os.path dependency when transitioning to S3
-        # and fix saving method from plt to boto3
+        # and fix saving method from PIL to boto3
         smallRelPath = filename+'_small.jpg'
         largeRelPath = filename+'_large.jpg'
 
         # TODO: consider removing PIL dependency once trail detection is
         # implemented, if it is implemented via OpenCV
-        normedImage = (normedImage.data*255).astype(np.uint8)
         # this is grayscale
         img = Image.fromarray(normedImage, "L")
 
         wpercent = (basewidth / float(img.size[0]))
         hsize = int((float(img.size[1]) * float(wpercent)))
-        img = img.resize((basewidth, hsize), Image.ANTIALIAS)
+        img = cls._resize(img, (basewidth, hsize))
 
         # img is PIL.Image object - simplify
         return ({"savepath": largeRelPath, "img": normedImage},
-                {"savepath": smallRelPath, "img": np.array(img)})
+                {"savepath": smallRelPath, "img": np.asarray(img)})
+
+    @classmethod
+    def _stretchedThumbnailLut(cls, vmin, vmax):
+        """Returns the `thumbnailLut` of an 8bit image, preceded by a linear
+        stretch of its [vmin, vmax] range onto [0, 255].
+
+        Parameters
+        ----------
+        vmin : `int`
+            Smallest value in the image.
+        vmax : `int`
+            Largest value in the image.
+
+        Returns
+        -------
+        lut : `np.array`
+            Lookup table of 256 gray levels.
+        """
+        scale = 255/(float(vmax) - float(vmin)) if vmax > vmin else 0
+        levels = (np.arange(256, dtype=np.float32) - vmin) * scale
+        return cls.thumbnailLut[np.clip(levels, 0, 255).astype(np.uint8)]
 
     @classmethod
     def _storeThumbnail(cls, thumbnail, savepath=None, pil_kwargs={"quality": 30}):
@@ -159,9 +332,10 @@ class FitsProcessor(UploadProcessor):
 
         Parameters
         ----------
-        thumbnail : `dict` or `np.array`
+        thumbnail : `dict`, `np.array` or `PIL.Image.Image`
             Either a dictionary containing `savepath` and `thumb` image or just
-            the thumbnail image.
+            the thumbnail image. Grayscale PIL images are saved without a
+            round-trip through numpy.
         savepath : `str`, optional
             If given thumbnail is just the image it is required to supply the
             save location of the thumbnail.
@@ -181,7 +355,26 @@ class FitsProcessor(UploadProcessor):
             raise ValueError("Expected a dict or an image and savepath, got "
                              f"thumbnail={thumbnail} and savepath={savepath} "
                              "instead.")
-        plt.imsave(savePath, thumb, cmap="Greys", pil_kwargs=pil_kwargs)
+        # stretch to [0, 255] and map through the colormap LUT, writing
+        # grayscale JPEGs with PIL directly
+        if isinstance(thumb, Image.Image) and thumb.mode == "L":
+            lut = cls._stretchedThumbnailLut(*thumb.getextrema())
+            thumb.point(lut.tolist()).save(savePath, format="JPEG", **pil_kwargs)
+            return
+
+        thumb = np.asarray(thumb)
+        vmin, vmax = thumb.min(), thumb.max()
+        if thumb.dtype == np.uint8:
+            # thumbnails are normally already 8bit, fold the stretch into the
+            # LUT and map the image in a single pass without float temporaries
+            thumb = cls._stretchedThumbnailLut(vmin, vmax)[thumb]
+        else:
+            scale = 255/(float(vmax) - float(vmin)) if vmax > vmin else 0
+            thumb = np.array(thumb, dtype=np.float32)
+            thumb -= vmin
+            thumb *= scale
+            thumb = cls.thumbnailLut[thumb.astype(np.uint8)]
+        Image.fromarray(thumb, "L").save(savePath, format="JPEG", **pil_kwargs)
 
     @classmethod
     @abstractmethod
@@ -191,7 +384,7 @@ class FitsProcessor(UploadProcessor):
 
         if uploadedFile.extension.lower() in cls.extensions:
             try:
-                hdulist = fits.open(uploadedFile.tmpfile.temporary_file_path())
+                hdulist = cls._openFits(uploadedFile)
             except OSError:
                 # OSError - file is corrupted, or isn't a fits
                 # FileNotFoundError - upload is bad file, reraise!
@@ -307,49 +500,58 @@ class FitsProcessor(UploadProcessor):
             A dataclass containing the standardized header and locations of the
             Thumbnails.
         """
-        # TODO: get some error handling here
-        # Insert upload info into DB
-        self.uploadInfo.save()
-
-        # get the new metadata and set up the relationship between metadata and
-        # UploadInfo, Relationship between Meta and WCS are set in stdHead.save
-        standardizedResult = StandardizedResult(header=self.standardizeHeader())
-
-        standardizedResult.metadata.upload_info = self.uploadInfo
-        standardizedResult.metadata.save()
-        for wcs in standardizedResult.wcs:
-            wcs.metadata = standardizedResult.metadata
-            wcs.save()
-
-        # Create thumbnails (their DB models and the files) and then set up
-        # relationship between particular wcs data and thumbs; then insert them
-        # TODO: I'm iffed how this is set here, maybe refactor?
-        logger.info(f"ID {self.uploadInfo.id}: Creating thumbnails.")
-        tmpResult = self.createThumbnails()
-        if isinstance(tmpResult, Thumbnails):
-            standardizedResult.appendThumbnail(tmpResult)
-        else:
-            standardizedResult.extendThumbnails(tmpResult)
-
-        # TODO: standardizedResult assume each wcs will have a thumbnail,
-        # which is technically true, but not each thumbnail is only of that wcs
-        # Some thumbnails link to many wcs's - this is a BUG, URGENT FIX, thumbs
-        # is not 1-to-1 relationship with wcs but 1 thumb can have many wcs's
-        # (probably breaks gallery, so I can't handle it atm)
-        if len(standardizedResult.thumbnails) == 1:
-            thumb = standardizedResult.thumbnails[0]
+        # the file is memory mapped, release it however processing ends
+        try:
+            # Insert upload info into DB
+            self.uploadInfo.save()
+
+            # get the new metadata and set up the relationship between metadata and
+            # UploadInfo, Relationship between Meta and WCS are set in stdHead.save
+            standardizedResult = StandardizedResult(header=self.standardizeHeader())
+
+            standardizedResult.metadata.upload_info = self.uploadInfo
+            standardizedResult.metadata.save()
+            # multi-extension files can carry dozens of WCSs, insert them in one
+            # query. Thumbnails reference the WCSs by their primary keys, so
+            # that's only possible when the database reports them back
             for wcs in standardizedResult.wcs:
-                thumb.wcs = wcs
-            thumb.save()
-        elif len(standardizedResult.thumbnails) == len(standardizedResult.wcs):
-            for thumb, wcs in zip(standardizedResult.thumbnails, standardizedResult.wcs):
-                thumb.wcs = wcs
-                thumb.save()
-        else:
-            raise RuntimeError("Can not unambiguously assign thumbnails to WCSs!")
+                wcs.metadata = standardizedResult.metadata
+            if connection.features.can_return_rows_from_bulk_insert:
+                Wcs.objects.bulk_create(standardizedResult.wcs)
+            else:
+                for wcs in standardizedResult.wcs:
+                    wcs.save()
+
+            # Create thumbnails (their DB models and the files) and then set up
+            # relationship between particular wcs data and thumbs; then insert them
+            # TODO: I'm iffed how this is set here, maybe refactor?
+            logger.info(f"ID {self.uploadInfo.id}: Creating thumbnails.")
+            tmpResult = self.createThumbnails()
+            if isinstance(tmpResult, Thumbnails):
+                standardizedResult.appendThumbnail(tmpResult)
+            else:
+                standardizedResult.extendThumbnails(tmpResult)
+
+            # TODO: standardizedResult assume each wcs will have a thumbnail,
+            # which is technically true, but not each thumbnail is only of that wcs
+            # Some thumbnails link to many wcs's - this is a BUG, URGENT FIX, thumbs
+            # is not 1-to-1 relationship with wcs but 1 thumb can have many wcs's
+            # (probably breaks gallery, so I can't handle it atm)
+            if len(standardizedResult.thumbnails) == 1:
+                thumb = standardizedResult.thumbnails[0]
+                for wcs in standardizedResult.wcs:
+                    thumb.wcs = wcs
+            elif len(standardizedResult.thumbnails) == len(standardizedResult.wcs):
+                for thumb, wcs in zip(standardizedResult.thumbnails, standardizedResult.wcs):
+                    thumb.wcs = wcs
+            else:
+                raise RuntimeError("Can not unambiguously assign thumbnails to WCSs!")
+            Thumbnails.objects.bulk_create(standardizedResult.thumbnails)
 
-        # lastly, don't forget to upload the original science data.
-        logger.info(f"ID {self.uploadInfo.id}: Uploading raw file.")
-        self.uploadedFile.save()
+            # lastly, don't forget to upload the original science data.
+            logger.info(f"ID {self.uploadInfo.id}: Uploading raw file.")
+            self.uploadedFile.save()
 
-        return standardizedResult
+            return standardizedResult
+        finally:
+            self.close()
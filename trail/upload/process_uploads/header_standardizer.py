@@ -3,18 +3,21 @@ Class that facilitates FITS header standardization to keys required by models.
 """
 
 from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+import functools
 import warnings
 import logging
+import math
 
 import numpy as np
 from astropy.io.fits import PrimaryHDU, CompImageHDU, ImageHDU
 from astropy.io import fits
 from astropy.wcs import WCS
-import astropy.units as u
 from astroquery.astrometry_net import AstrometryNet
 from trail.settings import ASTROMETRY_KEY, ASTROMETRY_TIMEOUT
 
 import upload.models as models
+from query.coord_conversion import equatorial_to_unitsphere
 
 __all__ = ["HeaderStandardizer", ]
 
@@ -72,6 +75,10 @@ class HeaderStandardizer(ABC):
     standardizers = dict()
     """All registered header standardizers."""
 
+    _byPriority = []
+    """Registered header standardizers, ordered from highest to lowest
+    priority."""
+
     name = None
     """Standardizer's name. Only named standardizers will be registered."""
 
@@ -91,6 +98,43 @@ class HeaderStandardizer(ABC):
         if name and name is not None:
             super().__init_subclass__(**kwargs)
             HeaderStandardizer.standardizers[cls.name] = cls
+            HeaderStandardizer._byPriority = sorted(
+                HeaderStandardizer.standardizers.values(),
+                key=lambda standardizer: standardizer.priority,
+                reverse=True
+            )
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _parseUtc(timestamp):
+        """Parses an ISO 8601 formatted UTC timestamp, with or without
+        fractional seconds, into a timezone aware datetime.
+
+        Exposures in a sequence often share their timestamps, and parsing is
+        the most expensive part of standardizing metadata, so parsed
+        timestamps are cached.
+
+        Parameters
+        ----------
+        timestamp : `str`
+            Timestamp, i.e. ``YYYY-MM-DDThh:mm:ss[.ffffff][Z]``.
+
+        Returns
+        -------
+        parsed : `datetime.datetime`
+            Timezone aware datetime in UTC.
+        """
+        try:
+            parsed = datetime.fromisoformat(timestamp)
+        except ValueError:
+            # before Python 3.11 fromisoformat accepts neither the "Z" suffix
+            # nor fractions of a second other than 3 or 6 digits long
+            fmt = "%Y-%m-%dT%H:%M:%S.%f" if "." in timestamp else "%Y-%m-%dT%H:%M:%S"
+            parsed = datetime.strptime(timestamp.rstrip("Z"), fmt)
+
+        if parsed.tzinfo is None:
+            return parsed.replace(tzinfo=timezone.utc)
+        return parsed.astimezone(timezone.utc)
 
     @staticmethod
     def _computeStandardizedWcs(header, dimX, dimY):
@@ -114,6 +158,11 @@ class HeaderStandardizer(ABC):
             Calculated coorinate values, a dict with wcs_radius,
             wcs_center_[x, y, z] and wcs_corner_[x, y, z]
 
+        Raises
+        ------
+        ValueError
+            WCS described by the header has no celestial axes.
+
         Notes
         -----
         The center point is assumed to be at the (dimX/2, dimY/2) pixel
@@ -128,36 +177,30 @@ class HeaderStandardizer(ABC):
                 for w in warns:
                     logger.warning(w.message)
 
-        centerSkyCoord = wcs.pixel_to_world(centerX, centerY)
-        centerRa = centerSkyCoord.ra.to(u.rad)
-        centerDec = centerSkyCoord.dec.to(u.rad)
-
-        cornerSkyCoord = wcs.pixel_to_world(0, 0)
-        cornerRa = cornerSkyCoord.ra.to(u.rad)
-        cornerDec = cornerSkyCoord.dec.to(u.rad)
-
-        unitSphereCenter = np.array([
-            np.cos(centerDec) * np.cos(centerRa),
-            np.cos(centerDec) * np.sin(centerRa),
-            np.sin(centerDec)
-        ])
-
-        unitSphereCorner = np.array([
-            np.cos(cornerDec) * np.cos(cornerRa),
-            np.cos(cornerDec) * np.sin(cornerRa),
-            np.sin(cornerDec)
-        ])
-
-        unitRadius = np.linalg.norm(unitSphereCenter - unitSphereCorner)
-        standardizedWcs["radius"] = unitRadius
-
-        standardizedWcs["center_x"] = unitSphereCenter[0]
-        standardizedWcs["center_y"] = unitSphereCenter[1]
-        standardizedWcs["center_z"] = unitSphereCenter[2]
-
-        standardizedWcs["corner_x"] = unitSphereCorner[0]
-        standardizedWcs["corner_y"] = unitSphereCorner[1]
-        standardizedWcs["corner_z"] = unitSphereCorner[2]
+        # transform center and corner pixels together, in that order. Plain
+        # arrays of world coordinates, including distortions, are enough; no
+        # need for SkyCoords and Quantities
+        world = wcs.all_pix2world(np.array([[centerX, centerY], [0, 0]], dtype=np.float64), 0)
+        if wcs.wcs.lng < 0 or wcs.wcs.lat < 0:
+            raise ValueError("WCS contains no celestial axes.")
+        ra = np.deg2rad(world[:, wcs.wcs.lng])
+        dec = np.deg2rad(world[:, wcs.wcs.lat])
+        unitSphere = equatorial_to_unitsphere(ra, dec)
+        # for a single pair of 3-vectors plain floats are cheaper than numpy
+        center, corner = np.stack(
+            (unitSphere["x"], unitSphere["y"], unitSphere["z"]),
+            axis=1
+        ).tolist()
+
+        standardizedWcs["radius"] = math.dist(center, corner)
+
+        standardizedWcs["center_x"] = center[0]
+        standardizedWcs["center_y"] = center[1]
+        standardizedWcs["center_z"] = center[2]
+
+        standardizedWcs["corner_x"] = corner[0]
+        standardizedWcs["corner_y"] = corner[1]
+        standardizedWcs["corner_z"] = corner[2]
 
         return standardizedWcs
 
@@ -215,28 +258,15 @@ class HeaderStandardizer(ABC):
         standardizerCls : `cls`
             Standardizer class that can process the given upload.`
         """
-        standardizers = []
-        for standardizer in cls.standardizers.values():
+        # standardizers are kept sorted by priority, so the first one that
+        # can process the header is the preferred one and the remaining,
+        # potentially expensive, checks can be skipped.
+        for standardizer in cls._byPriority:
             if standardizer.canStandardize(header):
-                standardizers.append(standardizer)
-
-        def get_priority(standardizer):
-            """Return standardizers priority."""
-            return standardizer.priority
-
-        standardizers.sort(key=get_priority, reverse=True)
-
-        if standardizers:
-            if len(standardizers) > 1:
-                # I think this should never be an issue really, but just in case
-                names = [proc.name for proc in standardizers]
-                logger.info("Multiple standardizers declared ability to process "
-                            f"the given upload: {names}. Using {names[-1]} "
-                            "to process FITS.")
-            return standardizers[0]
-        else:
-            raise ValueError("None of the known standardizers can handle this upload.\n "
-                             f"Known standardizers: {list(cls.standardizers.keys())}")
+                return standardizer
+
+        raise ValueError("None of the known standardizers can handle this upload.\n "
+                         f"Known standardizers: {list(cls.standardizers.keys())}")
 
     @classmethod
     def fromHeader(cls, header, **kwargs):
@@ -321,6 +351,10 @@ class HeaderStandardizer(ABC):
                 header, dimX, dimY = self._guessHeaderAndDims(hdu)
                 test = self._computeStandardizedWcs(header, dimX, dimY)
             except (ValueError, TypeError, AttributeError):
+                # uploads held in memory have no file astrometry.net could solve
+                if self.filepath is None:
+                    raise ValueError("Header contains no usable WCS and the upload has no file on "
+                                     "disk that could be solved by astrometry.net.")
                 header, dimX, dimY = self._astrometryNetSolver(self.filepath)
                 test = self._computeStandardizedWcs(header, dimX, dimY)
         except (ValueError, RuntimeError, TypeError) as err:
@@ -374,11 +408,13 @@ class HeaderStandardizer(ABC):
             if not (isinstance(hdu, PrimaryHDU) or isinstance(hdu, CompImageHDU) or isinstance(hdu, ImageHDU)):
                 raise TypeError(f"Expected image-like HDU, got {type(hdu)} instead.")
 
-            if hdu.data is None:
+            # shape is read from the header, accessing data would read the
+            # whole, possibly compressed, image just to get its dimensions
+            if not hdu.shape:
                 raise ValueError("Given image-type HDU contains no image to take"
                                  "image dimensions from.")
 
-            dimX, dimY = hdu.data.shape
+            dimX, dimY = hdu.shape
             header = hdu.header
         else:
             header = self.header
@@ -423,7 +459,8 @@ class HeaderStandardizer(ABC):
         -----
         Send the file to astrometry.net to find WCS from the location of the stars in the image
         """
-        dimX, dimY = fits.open(path_to_file)[0].data.shape
+        with fits.open(path_to_file) as hdulist:
+            dimX, dimY = hdulist[0].shape
         if ASTROMETRY_KEY:
             header = ASTRONET_CLIENT.solve_from_image(path_to_file, False, solve_timeout=ASTROMETRY_TIMEOUT)
             if header == {}:
@@ -10,7 +10,15 @@ present in Community Pipelines products.
 """
 
 
-from PIL import Image, ImageOps
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+import functools
+import os
+import threading
+
+from django.conf import settings
+from PIL import Image
 import numpy as np
 
 from .multi_extension_fits import MultiExtensionFits
@@ -49,6 +57,38 @@ row_layout = {
 """A row-based layour of the DECam focal plane science detectors."""
 
 
+def _flattenRowLayout(layout):
+    """Flattens a row-based layout of detectors in a single pass.
+
+    Parameters
+    ----------
+    layout : `dict`
+        Row-based layout of detectors, see `row_layout`.
+
+    Returns
+    -------
+    labels : `tuple`
+        All detector labels, row by row.
+    labelToIndex : `dict`
+        Map between detector labels and their positional indices.
+    indexToLabel : `dict`
+        Map between detector positional indices and their labels.
+    labelToRowType : `dict`
+        Map between detector labels and their row type.
+    """
+    labels, labelToIndex, indexToLabel, labelToRowType = [], {}, {}, {}
+    for row in layout.values():
+        for name, index in zip(row["names"], row["indices"]):
+            labels.append(name)
+            labelToIndex[name] = index
+            indexToLabel[index] = name
+            labelToRowType[name] = row["rtype"]
+    return tuple(labels), labelToIndex, indexToLabel, labelToRowType
+
+
+_LABELS, _LABEL_TO_INDEX, _INDEX_TO_LABEL, _LABEL_TO_ROWTYPE = _flattenRowLayout(row_layout)
+
+
 class Detector:
     """A single DECam science CCD detector.""""""
 
@@ -67,16 +107,13 @@ class Detector:
     ydim : `int`, optional
         Detector's physical height, in pixels. Defaults to 2048
     """
-    index_detector_map = {name: index for row in row_layout.values()
-                          for name, index in zip(row["names"], row["indices"])}
+    index_detector_map = _INDEX_TO_LABEL
     """Map between detector index and detector label."""
 
-    detector_index_map = {name: index for row in row_layout.values()
-                          for name, index in zip(row["names"], row["indices"])}
+    detector_index_map = _LABEL_TO_INDEX
     """Map between detector labels and their positional indices."""
 
-    detector_type_map = {name: row["rtype"] for row in row_layout.values()
-                         for name in row["names"]}
+    detector_type_map = _LABEL_TO_ROWTYPE
     """Map between detector labels and their row type."""
 
     dimX = 4096
@@ -133,8 +170,18 @@ class DecamFocalPlane:
     rowOffset : `int`, optional
         Physical offset, in pixels, between 'even' and 'odd' rows.
     """
-    detector_labels = [name for row in row_layout.values() for name in row["names"]]
-    """A list of all detector labels."""
+    detector_labels = _LABELS
+    """All detector labels."""
+
+    detector_rows = np.array([_LABEL_TO_INDEX[label][0] for label in _LABELS])
+    """Row index of each detector, in the order of `detector_labels`."""
+
+    detector_cols = np.array([_LABEL_TO_INDEX[label][1] for label in _LABELS])
+    """Column index of each detector, in the order of `detector_labels`."""
+
+    detector_odd = np.array([_LABEL_TO_ROWTYPE[label] == "odd" for label in _LABELS])
+    """Whether each detector, in the order of `detector_labels`, lies in an
+    odd, offset, row."""
 
     nRows = 7
     """Number of detector rows in the focal plane."""
@@ -154,12 +201,32 @@ class DecamFocalPlane:
         self.rowOffset = self.row_offset if rowOffset is None else rowOffset
         self.__initAssumedDetectorDimensions(detectorSize)
 
-        self.detectors = {}
-        for label in self.detector_labels:
-            self.detectors[label] = Detector(scaling, label=label)
+        self.detectors = self._getDetectors(scaling)
+
+        # placing images is the hot path, compute all detector locations at
+        # once. Odd rows are offset by half a detector in x.
+        xStarts = self.detector_rows*self.scaledGappedX + self.detector_odd*self.scaledRowOffset
+        yStarts = self.detector_cols*self.scaledGappedY
+        self.slices = {
+            label: (slice(x, x+self.scaledX), slice(y, y+self.scaledY))
+            for label, x, y in zip(self.detector_labels, xStarts.tolist(), yStarts.tolist())
+        }
+        # the plane image, stored transposed, only needs to reach the far
+        # edges of the outermost detectors
+        self.planeShape = (int(yStarts.max()) + self.scaledY, int(xStarts.max()) + self.scaledX)
 
         self.planeImage = None
 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _getDetectors(scaling):
+        """Returns a read-only mapping of detector labels to detectors scaled
+        by the given factor. Detectors are created once per scaling factor and
+        shared between focal planes.
+        """
+        return MappingProxyType({label: Detector(scaling, label=label)
+                                 for label in DecamFocalPlane.detector_labels})
+
     def __initAssumedDetectorDimensions(self, detectorSize=None):
         """In general there is no reason to assume all detectors have the same
         sizes, gaps or offsets. But for DECam they do and this lets us perform
@@ -187,12 +254,6 @@ class DecamFocalPlane:
         self.scaledGappedY = self.scaledY + self.scaledGap
         self.scaledGappedOffsetX = self.scaledGappedX*1.5 + self.scaledGap
 
-    def _even_row_coords(self, i, j):
-        return (i*self.scaledGappedX), int(j*self.scaledGappedY)
-
-    def _odd_row_coords(self, i, j):
-        return (self.scaledRowOffset + i*self.scaledGappedX), j*self.scaledGappedY
-
     def get_coords(self, detectorLabel):
         """Get start and end coordinates of the scaled detector.
 
@@ -208,16 +269,8 @@ class DecamFocalPlane:
         yCoordinates : `tuple`
             Tuple of start and end coordinates in the y axis.
         """
-        detector = self.detectors[detectorLabel]
-        if detector.rowType == "even":
-            coords = self._even_row_coords(detector.row, detector.col)
-        elif detector.rowType == "odd":
-            coords = self._odd_row_coords(detector.row, detector.col)
-        else:
-            raise ValueError("Unrecognized row type. Expected 'odd' or 'even' "
-                             "got {detector.rowType} instead.")
-
-        return (coords[0], coords[0]+self.scaledX), (coords[1], coords[1]+self.scaledY)
+        xSlice, ySlice = self.slices[detectorLabel]
+        return (xSlice.start, xSlice.stop), (ySlice.start, ySlice.stop)
 
     def get_slice(self, detectorLabel):
         """Get array slice that covers the area of the detector.
@@ -234,8 +287,7 @@ class DecamFocalPlane:
         ySlice : `tuple`
             An edge-to-edge slice of the detector, i.e. [start:end], in y axis.
         """
-        coords = self.get_coords(detectorLabel)
-        return slice(*coords[0]), slice(*coords[1])
+        return self.slices[detectorLabel]
 
     def add_image(self, image, detectorLabel):
         """Will place the given image at the location of the given detector
@@ -244,8 +296,8 @@ class DecamFocalPlane:
         Parameters
         ----------
         image : `np.array`
-            A 2D array representing the image that will be placed at the
-            location of the detector
+            A 2D array of unsigned 8bit integers representing the image that
+            will be placed at the location of the detector
         detectorLabel : `str`
             The label of the detector.
 
@@ -254,14 +306,21 @@ class DecamFocalPlane:
         Depending on the scaling factor used, materializing the full focal
         plane can require a lot of memory. The plane image will not be
         materialized until the firt image is placed in it.
+
+        The plane image is stored transposed, i.e. in the orientation in which
+        it is displayed, so that it can be saved without a copy. Large zeroed
+        arrays are lazily mapped by the OS, so the areas no detector covers
+        cost no memory traffic.
         """
         if self.planeImage is None:
-            self.planeImage = np.zeros((self.nRows*self.scaledGappedX,
-                                        self.nCols*self.scaledGappedY),
-                                       dtype=np.uint8)
+            self.planeImage = np.zeros(self.planeShape, dtype=np.uint8)
 
-        start, end = self.get_slice(detectorLabel)
-        self.planeImage[start, end] = image
+        xSlice, ySlice = self.slices[detectorLabel]
+        # the target is a block of contiguous plane rows, copy straight into
+        # it rather than going through generic slice assignment. Images are
+        # expected to be 8bit already, unnormalized float images are refused
+        # rather than silently truncated.
+        np.copyto(self.planeImage[ySlice, xSlice], np.asarray(image).T)
 
 
 class DecamFits(MultiExtensionFits):
@@ -269,22 +328,30 @@ class DecamFits(MultiExtensionFits):
     name = "DECamCommunityFits"
     priority = 2
 
+    maxWorkers = settings.THUMBNAIL_WORKERS or min(8, os.cpu_count() or 1)
+    """Maximum number of CCD images processed concurrently, which also bounds
+    the number of CCD images, and their scratch buffers, held in memory at
+    once. Set by the ``thumbnail_workers`` site configuration key, defaults to
+    the number of CPUs, up to 8."""
+
     def __init__(self, uploadInfo, uploadedFile):
         super().__init__(uploadInfo, uploadedFile)
         # Override the default processed exts to filter only science images
         # from all image-like exts, ignoring focus and guider chips.
         self.exts = self._getScienceImages(self.exts)
+        self._scratch = threading.local()
+
+    @staticmethod
+    def _isScienceImage(hdu):
+        """Returns `True` when the HDU is a science CCD, i.e. it is a detector
+        that is neither a guider nor a focus chip.
+        """
+        exttype = hdu.header.get("DETPOS", False)
+        return bool(exttype) and "G" not in exttype and "F" not in exttype
 
     @classmethod
     def _getScienceImages(cls, hdulist):
-        exts = []
-        for hdu in hdulist:
-            exttype = hdu.header.get("DETPOS", False)
-            if exttype:
-                if "G" not in exttype and "F" not in exttype:
-                    exts.append(hdu)
-
-        return exts
+        return [hdu for hdu in hdulist if cls._isScienceImage(hdu)]
 
     @classmethod
     def canProcess(cls, uploadedFile, returnHdulist=False):
@@ -293,47 +360,207 @@ class DecamFits(MultiExtensionFits):
         # Data examples I have seen Community Pipeines exclusively utilize the
         # CompImageHDU headers and at any time in history there was at most 1
         # Here, we bet that if we are near 62 CCDs encoded as CompImageHDUs,
-        # ignoring guider and focus, we are looking at DECam CP product
-        exts = cls._getScienceImages(hdulist)
-
-        if len(exts) > 60 and len(exts) <= 62:
-            canProcess = canProcess and True
-        else:
-            canProcess = canProcess and False
+        # ignoring guider and focus, we are looking at DECam CP product.
+        # Only headers are inspected and counting stops as soon as there are
+        # too many science CCDs for this to be a DECam focal plane.
+        if canProcess:
+            nScience = 0
+            for hdu in hdulist:
+                nScience += cls._isScienceImage(hdu)
+                if nScience > 62:
+                    break
+            canProcess = 60 < nScience <= 62
 
         if returnHdulist:
             return canProcess, hdulist
         return canProcess
 
+    @staticmethod
+    def _equalizationLut(hist):
+        """Returns the histogram equalization lookup table for the given
+        256-bin histogram of an 8bit image, as computed by PIL's equalize.
+        """
+        step = (hist.sum() - hist[np.flatnonzero(hist)[-1]]) // 255
+        if not step:
+            return np.arange(256, dtype=np.uint8)
+        lut = (np.cumsum(hist) - hist + step//2) // step
+        return np.minimum(lut, 255).astype(np.uint8)
+
     @classmethod
-    def normalizeImage(cls, image):
+    def normalizeImage(cls, image, out=None):
         # astropy equalizer averages 4.3 seconds, the PIL approach can bring
         # that down to cca 0.13. Without normalization the time is 0.04s
-        avg, std = image.mean(), image.std()
-        image[image > (avg + 0.5*std)] = avg + 0.5*std
-        image[image < (avg - 0.5*std)] = avg - 0.5*std
-        image = image/image.max()
-        image = (image*255).astype(np.uint8)
+        # Clip to half a sigma around the mean, rescale to [0, 255] and
+        # equalize the histogram via a lookup table, mimicking PIL's equalize
+        # without the PIL round-trip. Input is never modified in-place, the
+        # intermediate float32 image is written to `out`, when given.
+        # single precision statistics, std would otherwise allocate a float64
+        # temporary 4 times the size of a typical 16bit CCD image
+        avg, std = image.mean(dtype=np.float32), image.std(dtype=np.float32)
+        lo, hi = avg - 0.5*std, avg + 0.5*std
+
+        if image.dtype.kind in "iu" and image.dtype.itemsize <= 2:
+            return cls._normalizeSmallIntImage(image, lo, hi)
+
+        out = np.empty(image.shape, dtype=np.float32) if out is None else out
+        image = cls._clipAndRescale(image, lo, hi, out)
+        hist = np.bincount(image.ravel(), minlength=256)
+        return cls._equalizationLut(hist)[image]
+
+    @staticmethod
+    def _clipAndRescale(image, lo, hi, out):
+        """Clips the image to the [lo, hi] range and rescales it to 8bit.
+
+        Parameters
+        ----------
+        image : `np.array`
+            Image.
+        lo : `float`
+            Lower clip bound.
+        hi : `float`
+            Upper clip bound.
+        out : `np.array`
+            Array of 32bit floats, of the same shape as the image, holding
+            the intermediate rescaled image.
 
-        image = Image.fromarray(image, "L")
-        image = ImageOps.equalize(image, mask=None)
+        Returns
+        -------
+        image : `np.array`
+            Rescaled 8bit image.
+        """
+        scaled = np.clip(image, lo, hi, out=out)
+        scaled -= lo
+        if hi > lo:
+            scaled *= 255/(hi - lo)
+        return scaled.astype(np.uint8)
 
-        return image
+    @classmethod
+    def _normalizeSmallIntImage(cls, image, lo, hi):
+        """Clips, rescales and equalizes an 8 or 16 bit integer image without
+        leaving its native integer width.
 
-    def _createFocalPlaneImage(self, focalPlane):
-        for ext in self.exts:
-            # no matter how painful this is, if we don't, normalize will mutate
-            # in science data in place....
-            image = ext.data.copy()
-            image = self.normalizeImage(image)
+        Clipped pixels are converted to offsets from the lower clip bound and
+        both the rescaling and the equalization are folded into a single
+        lookup table, indexed by those offsets. The result is identical to
+        the one of the generic, floating point, normalization.
 
-            # TODO: test here if the step-vise resizing is faster...
-            image = image.resize((focalPlane.scaledY, focalPlane.scaledX),
-                                 Image.ANTIALIAS)
+        Parameters
+        ----------
+        image : `np.array`
+            Image of 8 or 16 bit integers.
+        lo : `float`
+            Lower clip bound.
+        hi : `float`
+            Upper clip bound.
 
-            focalPlane.add_image(image, ext.header["DETPOS"])
+        Returns
+        -------
+        image : `np.array`
+            Normalized 8bit image.
+        """
+        # every pixel outside of the integer bounds enclosing [lo, hi] maps
+        # to the same level as the bound itself
+        limits = np.iinfo(image.dtype)
+        loInt = max(int(np.floor(lo)), int(limits.min))
+        hiInt = min(int(np.ceil(hi)), int(limits.max))
+
+        clipped = np.clip(image, loInt, hiInt)
+        # offsets span at most the dtype's range, so they fit the unsigned
+        # type of the same width, even when the signed subtraction wraps
+        np.subtract(clipped, loInt, out=clipped, casting="unsafe")
+        offsets = clipped.view(clipped.dtype.str.replace("i", "u"))
+
+        # each integer value is rescaled exactly like pixels are in the
+        # floating point path, so both produce the same levels
+        nLevels = hiInt - loInt + 1
+        counts = np.bincount(offsets.ravel(), minlength=nLevels)
+        values = np.arange(loInt, hiInt + 1, dtype=image.dtype)
+        levels = cls._clipAndRescale(values, lo, hi, np.empty(nLevels, dtype=np.float32))
+
+        hist = np.bincount(levels, weights=counts, minlength=256).astype(np.int64)
+        return cls._equalizationLut(hist)[levels][offsets]
+
+    def _createCcdImages(self, image, sizes):
+        """Normalizes a single CCD image and resizes it to each of the given
+        sizes.
 
-        return focalPlane
+        Parameters
+        ----------
+        image : `np.array`
+            CCD image.
+        sizes : `list[tuple[int, int]]`
+            Sizes of the resized images, as (width, height) tuples.
+
+        Returns
+        -------
+        ccdImages : `list[np.array]`
+            Normalized and resized CCD images, one for each size.
+        """
+        # all CCDs have the same shape, reuse one scratch buffer per thread
+        scratch = getattr(self._scratch, "buffer", None)
+        if scratch is None or scratch.shape != image.shape:
+            scratch = np.empty(image.shape, dtype=np.float32)
+            self._scratch.buffer = scratch
+        image = self.normalizeImage(image, out=scratch)
+
+        ccdImages = []
+        for width, height in sizes:
+            # integer scalings, like the default ones, are plain block
+            # averages, much cheaper than a resampling filter
+            factor = image.shape[0] // height
+            if factor > 1 and image.shape[0] // factor == height and image.shape[1] // factor == width:
+                ccdImages.append(self._blockMean(image, factor))
+            else:
+                resized = self._resize(Image.fromarray(image, "L"), (width, height))
+                ccdImages.append(np.asarray(resized))
+
+        return ccdImages
+
+    def _createFocalPlaneImages(self, focalPlanes):
+        """Places normalized and resized CCD images in each of the given focal
+        planes.
+
+        Each CCD is read, and decompressed, only once for all of the focal
+        planes and is released from memory as soon as it was processed.
+
+        Parameters
+        ----------
+        focalPlanes : `list[DecamFocalPlane]`
+            Focal planes.
+
+        Returns
+        -------
+        focalPlanes : `list[DecamFocalPlane]`
+            Focal planes with CCD images placed in them.
+        """
+        sizes = [(plane.scaledY, plane.scaledX) for plane in focalPlanes]
+
+        def addImages(detectorLabel, future):
+            for plane, ccdImage in zip(focalPlanes, future.result()):
+                plane.add_image(ccdImage, detectorLabel)
+
+        # CCDs are independent, and numpy and PIL release the GIL, so they are
+        # normalized and resized concurrently. Reading from the file is not
+        # thread-safe so data is read here, while workers process previously
+        # read CCDs; the number of CCDs in flight is bounded to limit memory.
+        with ThreadPoolExecutor(self.maxWorkers) as executor:
+            pending = deque()
+            for ext in self.exts:
+                # normalization writes into its own float32 buffer and never
+                # touches the science data, no need to copy it. The HDU caches
+                # the decompressed data, drop it once it's handed to a worker
+                image = ext.data
+                del ext.data
+                future = executor.submit(self._createCcdImages, image, sizes)
+                del image
+                pending.append((ext.header["DETPOS"], future))
+                if len(pending) >= self.maxWorkers:
+                    addImages(*pending.popleft())
+
+            for detectorLabel, future in pending:
+                addImages(detectorLabel, future)
+
+        return focalPlanes
 
     def createThumbnails(self, scaling=(4, 10)):
         xdim = self.exts[0].header["NAXIS2"]
@@ -345,13 +572,8 @@ class DecamFits(MultiExtensionFits):
         relLargePath = self.uploadedFile.basename+'_plane_large.jpg'
         thumb = Thumbnails(large=relLargePath, small=relSmallPath)
 
-        # due to potential size of these images immediately release memory
-        smallThumb = self._createFocalPlaneImage(smallPlane)
-        self._storeThumbnail(smallThumb.planeImage.T, savepath=thumb.smallAbsPath)
-        del smallThumb
-
-        largeThumb = self._createFocalPlaneImage(largePlane)
-        self._storeThumbnail(largeThumb.planeImage.T, savepath=thumb.largeAbsPath)
-        del largeThumb
+        self._createFocalPlaneImages([largePlane, smallPlane])
+        self._storeThumbnail(smallPlane.planeImage, savepath=thumb.smallAbsPath)
+        self._storeThumbnail(largePlane.planeImage, savepath=thumb.largeAbsPath)
 
         return thumb
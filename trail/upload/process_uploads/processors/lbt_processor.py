@@ -7,6 +7,10 @@ create better visualisations.
 """
 
 
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from django.conf import settings
 from PIL import Image
 import numpy as np
 
@@ -43,11 +47,18 @@ class LbtFits(MultiExtensionFits):
     name = "LbtFits"
     priority = 2
 
+    maxWorkers = settings.THUMBNAIL_WORKERS or min(4, os.cpu_count() or 1)
+    """Maximum number of CCD images processed concurrently. Set by the
+    ``thumbnail_workers`` site configuration key, defaults to the number of
+    CPUs, up to 4, the number of science CCDs in an LBT focal plane."""
+
     def __init__(self, uploadInfo, uploadedFile):
         super().__init__(uploadInfo, uploadedFile)
         # Override the default processed exts to filter only science images
         # from all image-like exts, ignoring focus and guider chips.
         self.exts = self._getScienceImages(self.exts)
+        # CCD positions are read from the headers once, not per thumbnail
+        self.ccdSlots = [self._ccdSlot(ext.header['EXTNAME']) for ext in self.exts]
 
     @classmethod
     def _getScienceImages(cls, hdulist):
@@ -67,41 +78,121 @@ class LbtFits(MultiExtensionFits):
             return True
         return False
 
+    @staticmethod
+    def _ccdSlot(extname):
+        """Returns the position of the CCD in the focal plane: 1, 2 or 3 for
+        the bottom row CCDs, and 0 for the top one.
+
+        Parameters
+        ----------
+        extname : `str`
+            Name of the extension the CCD image was read from.
+
+        Returns
+        -------
+        slot : `int`
+            Position of the CCD.
+        """
+        for slot in (1, 2, 3):
+            if str(slot) in extname:
+                return slot
+        return 0
+
+    @staticmethod
+    def _ccdLocation(slot, dim):
+        """Returns the location of the CCD in the, display oriented, full
+        resolution focal plane image.
+
+        Parameters
+        ----------
+        slot : `int`
+            Position of the CCD, see `_ccdSlot`.
+        dim : `LbtConstants`
+            Dimensions of the CCDs and the focal plane.
+
+        Returns
+        -------
+        row : `int`
+            Row of the top left corner of the CCD.
+        col : `int`
+            Column of the top left corner of the CCD.
+        rotated : `bool`
+            `True` when the CCD is rotated with respect to the bottom row.
+        """
+        bottom = dim.focy - dim.ccdy
+        if slot == 1:
+            return bottom, dim.focx - dim.ccdx, False
+        elif slot == 2:
+            return bottom, dim.ccdx + dim.fill, False
+        elif slot == 3:
+            return bottom, 0, False
+        # top row we start half-way through first ccd
+        return 0, int(dim.ccdx/2) + dim.fill, True
+
+    def _placeCcd(self, img, data, slot, dim, scaling):
+        """Equalizes and downsamples the CCD image and places it at its
+        location in the focal plane image.
+
+        Parameters
+        ----------
+        img : `np.array`
+            Focal plane image, downsampled by ``scaling``.
+        data : `np.array`
+            CCD image.
+        slot : `int`
+            Position of the CCD, see `_ccdSlot`.
+        dim : `LbtConstants`
+            Dimensions of the CCDs and the focal plane.
+        scaling : `int` or `float`
+            Downsampling factor of the focal plane image.
+        """
+        # equalize straight into [0, 255], a single lookup per pixel
+        ccddata = self._histogramEqualize(data, 255, np.uint8)
+
+        # downsample before placing, so the full resolution focal plane is
+        # never materialized; integer scalings are plain block averages
+        height, width = int(ccddata.shape[0]/scaling), int(ccddata.shape[1]/scaling)
+        if scaling == int(scaling) and scaling > 1:
+            ccddata = self._blockMean(ccddata, int(scaling))
+        elif scaling != 1:
+            ccddata = np.asarray(self._resize(Image.fromarray(ccddata, "L"), (width, height)))
+
+        # The plane image is in display orientation, the bottom row CCDs are
+        # only flipped upside down, so every CCD row is copied into a
+        # contiguous plane row. The top CCD is rotated with respect to them.
+        row, col, rotated = self._ccdLocation(slot, dim)
+        ccddata = ccddata[::-1, ::-1].T if rotated else ccddata[::-1]
+        row, col = int(row/scaling), int(col/scaling)
+        img[row:row+ccddata.shape[0], col:col+ccddata.shape[1]] = ccddata
+
     def createThumbnails(self, scaling=(4, 10), dim=None):
         if dim is None:
             dim = LbtConstants()
 
-        img = np.zeros((dim.focx, dim.focy))
-
-        for ccd in self.exts:
-            ccddata = self.normalizeImage(ccd.data)
-            if '1' in ccd.header['EXTNAME']:
-                img[-dim.ccdx:, -dim.ccdy:] = np.fliplr(ccddata.T)
-            elif '2' in ccd.header['EXTNAME']:
-                startx = dim.ccdx + dim.fill
-                endx = 2*dim.ccdx + dim.fill
-                img[startx:endx, -dim.ccdy:] = np.fliplr(ccddata.T)
-            elif '3' in ccd.header['EXTNAME']:
-                img[:dim.ccdx, -dim.ccdy:] = np.fliplr(ccddata.T)
-            else:
-                # top row we start half-way through first ccd
-                startx, endx = int(dim.ccdx/2)+dim.fill, int(dim.focx/2) + dim.ccdx
-                img[startx:endx, :dim.ccdx] = np.flip(ccddata)
-
-        img = (img - img.min()) * 255/(img.max() - img.min())
-        img = Image.fromarray(img.astype(np.uint8), 'L')
-
-        newY, newX = int(dim.focy/scaling[0]), int(dim.focx/scaling[0])
-        img = img.resize((newY, newX), Image.ANTIALIAS)
-        newY, newX = int(dim.focy/scaling[1]), int(dim.focx/scaling[1])
-        smallImg = np.asarray(img.resize((newY, newX), Image.ANTIALIAS))
-        img = np.asarray(img)
+        # the large thumbnail is assembled directly at its final scale
+        img = np.zeros((int(dim.focy/scaling[0]), int(dim.focx/scaling[0])), dtype=np.uint8)
+
+        # CCDs are independent and land in disjoint parts of the focal plane,
+        # and numpy releases the GIL, so they are equalized and placed
+        # concurrently. Reading from the file is not thread-safe, so the data
+        # is read here while the workers process previously read CCDs.
+        with ThreadPoolExecutor(self.maxWorkers) as executor:
+            futures = [executor.submit(self._placeCcd, img, ccd.data, slot, dim, scaling[0])
+                       for ccd, slot in zip(self.exts, self.ccdSlots)]
+        for future in futures:
+            future.result()
+
+        # CCDs are already quantized and the gaps are black, no need to
+        # rescale the whole plane. The small thumbnail is resized from the
+        # large one.
+        newX, newY = int(dim.focx/scaling[1]), int(dim.focy/scaling[1])
+        smallImg = self._resize(Image.fromarray(img, 'L'), (newX, newY))
 
         relSmallPath = self.uploadedFile.basename+'_plane_small.jpg'
         relLargePath = self.uploadedFile.basename+'_plane_large.jpg'
         thumb = Thumbnails(large=relLargePath, small=relSmallPath)
 
-        self._storeThumbnail(smallImg.T, savepath=thumb.smallAbsPath)
-        self._storeThumbnail(img.T, savepath=thumb.largeAbsPath)
+        self._storeThumbnail(smallImg, savepath=thumb.smallAbsPath)
+        self._storeThumbnail(img, savepath=thumb.largeAbsPath)
 
         return thumb
@@ -22,27 +22,27 @@ class MultiExtensionFits(FitsProcessor):
 
     def __init__(self, uploadInfo, uploadedFile):
         super().__init__(uploadInfo, uploadedFile)
-        self.exts = []
-        for hdu in self.hdulist:
-            if self._isImageLikeHDU(hdu):
-                self.exts.append(hdu)
+        self.exts = [hdu for hdu in self.hdulist if self._isImageLikeHDU(hdu)]
 
     @staticmethod
     def _isImageLikeHDU(hdu):
-        if not any((isinstance(hdu, CompImageHDU), isinstance(hdu, PrimaryHDU),
-                    isinstance(hdu, ImageHDU))):
+        if not isinstance(hdu, (CompImageHDU, PrimaryHDU, ImageHDU)):
             return False
 
         # People store all kind of stuff even in ImageHDUs, let's make sure we
         # don't crash the server by saving 120k x 8000k table disguised as an
         # image (I'm looking at you SDSS!)
-        if hdu.data is None:
+        # Only the header is inspected, accessing the data would read, and for
+        # compressed HDUs decompress, every extension up front.
+        header = hdu.header
+        if header.get("NAXIS", 0) != 2:
             return False
 
-        if len(hdu.data.shape) != 2:
+        naxis1, naxis2 = header.get("NAXIS1", 0), header.get("NAXIS2", 0)
+        if naxis1 == 0 or naxis2 == 0:
             return False
 
-        if hdu.shape[0] > 6000 or hdu.shape[1] > 6000:
+        if naxis1 > 6000 or naxis2 > 6000:
             return False
 
         return True
@@ -56,10 +56,7 @@ class MultiExtensionFits(FitsProcessor):
         return canProcess
 
     def standardizeWcs(self):
-        standardizedWcs = []
-        for i, ext in enumerate(self.exts):
-            standardizedWcs.append(self.standardizer.standardizeWcs(hdu=ext))
-        return standardizedWcs
+        return [self.standardizer.standardizeWcs(hdu=ext) for ext in self.exts]
 
     def createThumbnails(self):
         thumbs = []
@@ -15,9 +15,10 @@ class SingleExtensionFits(FitsProcessor):
     name = "SingleExtensionFits"
     priority = 1
 
-    def __init__(self, uploadInfo, uploadedFile):
-        super().__init__(uploadInfo, uploadedFile)
-        self.imageData = self.hdulist["PRIMARY"].data
+    @property
+    def imageData(self):
+        """Primary HDU image data, read from the file on first access."""
+        return self.hdulist["PRIMARY"].data
 
     @classmethod
     def canProcess(cls, uploadedFile):
@@ -7,7 +7,7 @@ metadata.
 from upload.process_uploads.header_standardizer import HeaderStandardizer
 from upload.models import Metadata
 
-from astro_metadata_translator import ObservationInfo
+from astro_metadata_translator import ObservationInfo, MetadataTranslator
 
 
 __all__ = ["AstroMetadataTranslator", ]
@@ -18,33 +18,83 @@ class AstroMetadataTranslator(HeaderStandardizer):
     name = "astro_metadata_translator"
     priority = 2
 
+    translatedProperties = {"location", "datetime_begin", "datetime_end", "telescope", "instrument",
+                            "science_program", "exposure_time", "physical_filter"}
+    """ObservationInfo properties used to standardize the metadata; only these
+    are translated."""
+
+    _translatorCache = {}
+    """Translator classes previously matched to a header, keyed by the
+    header's instrument and telescope."""
+
     def __init__(self, header, filename=None, **kwargs):
         super().__init__(header, **kwargs)
         self.filename = filename
-        self.obsInfo = ObservationInfo(header, filename=filename)
+        translator = self._getTranslator(header, filename=filename)
+        self.obsInfo = ObservationInfo(header, filename=filename, translator_class=translator,
+                                       subset=self.translatedProperties)
+
+    @classmethod
+    def _getTranslator(cls, header, filename=None):
+        """Returns the translator class capable of translating the header.
+
+        Determining the translator probes every registered translator, so
+        the result is cached per instrument and telescope. A cached
+        translator is used only when it confirms it can translate the given
+        header.
+
+        Parameters
+        ----------
+        header : `dict-like`
+            Header.
+        filename : `str`, optional
+            Name of the file the header originates from.
+
+        Returns
+        -------
+        translator : `type`
+            Subclass of `astro_metadata_translator.MetadataTranslator`.
+
+        Raises
+        ------
+        ValueError
+            When no translator can translate the header.
+        """
+        key = (header.get("INSTRUME"), header.get("TELESCOP"))
+        translator = cls._translatorCache.get(key)
+        if translator is None or not translator.can_translate(header, filename=filename):
+            translator = MetadataTranslator.determine_translator(header, filename=filename)
+            cls._translatorCache[key] = translator
+        return translator
 
     @classmethod
     def canStandardize(cls, header, filename=None, **kwargs):
+        # Finding a translator is enough, ObservationInfo only raises a
+        # ValueError when there is none. Translating the header here would
+        # just repeat the work done when the standardizer is instantiated.
         try:
-            ObservationInfo(header, filename=filename)
+            cls._getTranslator(header, filename=filename)
         except ValueError:
             return False
         else:
             return True
 
     def standardizeMetadata(self):
-        location = self.obsInfo.location
+        # ObservationInfo properties and astropy Time scale conversions are
+        # computed on access, read each one only once
+        obsInfo = self.obsInfo
+        location = obsInfo.location
         meta = Metadata(
             obs_lon=location.lon.value,
             obs_lat=location.lat.value,
             obs_height=location.height.value,
-            datetime_begin=self.obsInfo.datetime_begin.tt.datetime.isoformat(),
-            datetime_end=self.obsInfo.datetime_end.tt.datetime.isoformat(),
-            standardizer_name=f"{self.name}.{self.obsInfo._translator.name}",
-            telescope=self.obsInfo.telescope,
-            instrument=self.obsInfo.instrument,
-            science_program=self.obsInfo.science_program,
-            exposure_duration=self.obsInfo.exposure_time.value,
-            filter_name=self.obsInfo.physical_filter
+            datetime_begin=obsInfo.datetime_begin.tt.datetime.isoformat(),
+            datetime_end=obsInfo.datetime_end.tt.datetime.isoformat(),
+            standardizer_name=f"{self.name}.{obsInfo._translator.name}",
+            telescope=obsInfo.telescope,
+            instrument=obsInfo.instrument,
+            science_program=obsInfo.science_program,
+            exposure_duration=obsInfo.exposure_time.value,
+            filter_name=obsInfo.physical_filter
         )
         return meta
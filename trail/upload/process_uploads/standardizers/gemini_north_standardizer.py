@@ -16,6 +16,23 @@ class GeminiNorthStandardizer(HeaderStandardizer):
     name = "gemini_north_standardizer"
     priority = 1
 
+    # Gemini North has changed their CCD's over the years. Using their official
+    # website, we know that the EEV was the CCD used before October of 2011, the
+    # e2v DD was the CCD used between October 2011 and June 2014, and the
+    # Hamamatsu CCD has been in use since June of 2014. These dates determine
+    # the CCD in use for the image at the time the image was taken.
+    e2vInstallDate = datetime(2011, 10, 1, tzinfo=timezone.utc)
+    """Date since which the e2v DD CCD was in use, replacing the EEV CCD."""
+
+    hamamatsuInstallDate = datetime(2014, 6, 1, tzinfo=timezone.utc)
+    """Date since which the Hamamatsu CCD is in use, replacing the e2v DD."""
+
+    obsHeight = 4213
+    """Height of the observatory, in meters, from the official website."""
+
+    telescope = "Gemini North"
+    """Telescope name."""
+
     def __init__(self, header, **kwargs):
         super().__init__(header, **kwargs)
 
@@ -29,27 +46,12 @@ class GeminiNorthStandardizer(HeaderStandardizer):
     def standardizeMetadata(self):
         DATEOBS = self.header["DATE-OBS"]
         EXP = self.header["EXPTIME"]
-        begin = datetime.strptime(DATEOBS, "%Y-%m-%dT%H:%M:%S.%f")
-        begin = begin.replace(tzinfo=timezone.utc)
+        begin = self._parseUtc(DATEOBS)
         end = begin + timedelta(seconds=EXP)
 
-        '''
-        Gemini North has changed their CCD's over the years. Using their official
-        website, we know that the EEV was the CCD used before October of 2011, the
-        e2v DD was the CCD used between October 2011 and June 2014, and the Hamamatsu
-        CCD has been in use since June of 2014. The following logic determines the
-        CCD in use for the image at the time the image was taken.
-        '''
-        oct_string = "2011-10-01T00:00:00.0"
-        october11 = datetime.strptime(oct_string, "%Y-%m-%dT%H:%M:%S.%f")
-        october11 = october11.replace(tzinfo=timezone.utc)
-        june_string = "2014-06-01T00:00:00.0"
-        june14 = datetime.strptime(june_string, "%Y-%m-%dT%H:%M:%S.%f")
-        june14 = june14.replace(tzinfo=timezone.utc)
-
-        if begin < october11:
+        if begin < self.e2vInstallDate:
             instrument = "EEV"
-        elif begin < june14:
+        elif begin < self.hamamatsuInstallDate:
             instrument = "e2v DD"
         else:
             instrument = "Hamamatsu"
@@ -57,10 +59,10 @@ class GeminiNorthStandardizer(HeaderStandardizer):
         meta = Metadata(
             obs_lon=self.header["GEOLON"],
             obs_lat=self.header["GEOLAT"],
-            obs_height=4213,  # height in meters from official website
+            obs_height=self.obsHeight,
             datetime_begin=begin.isoformat(),
             datetime_end=end.isoformat(),
-            telescope="Gemini North",
+            telescope=self.telescope,
             instrument=instrument,
             exposure_duration=self.header["EXPTIME"],
             filter_name=self.header["FILTER"].strip()
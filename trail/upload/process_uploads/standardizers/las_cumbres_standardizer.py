@@ -2,7 +2,6 @@
 Class that facilitates header metadata translation for Las Cumbres Observatory.
 """
 
-from datetime import datetime, timezone
 
 from upload.process_uploads.header_standardizer import HeaderStandardizer
 from upload.models import Metadata
@@ -35,15 +34,11 @@ class LasCumbresStandardizer(HeaderStandardizer):
         utstart = self.header["UTSTART"]
         utstop = self.header["UTSTOP"]
 
-        if self.header["TIMESYS"] == "UTC":
-            tzinfo = timezone.utc
-        else:
+        if self.header["TIMESYS"] != "UTC":
             raise ValueError("Can not recognize time scale system that is used?")
 
-        startDatetime = datetime.strptime(date+"T"+utstart, "%Y-%m-%dT%H:%M:%S.%f")
-        endDatetime = datetime.strptime(date+"T"+utstop, "%Y-%m-%dT%H:%M:%S.%f")
-        startDatetime = startDatetime.replace(tzinfo=tzinfo)
-        endDatetime = endDatetime.replace(tzinfo=tzinfo)
+        startDatetime = self._parseUtc(date+"T"+utstart)
+        endDatetime = self._parseUtc(date+"T"+utstop)
 
         # TODO: implement this lookup: https://arxiv.org/pdf/1305.2437.pdf
         # GP is essentially SDSS g filter, also figure out if filter none is
@@ -1,5 +1,5 @@
 
-from datetime import datetime, timedelta, timezone
+from datetime import timedelta
 
 from upload.process_uploads.header_standardizer import HeaderStandardizer
 from upload.models import Metadata
@@ -53,8 +53,7 @@ class LbtStandardizer(HeaderStandardizer):
         """
         DATE_OBS = self.header["DATE_OBS"]
         EXPTIME = self.header["EXPTIME"]
-        begin = datetime.strptime(DATE_OBS, "%Y-%m-%dT%H:%M:%S.%f")
-        begin = begin.replace(tzinfo=timezone.utc)
+        begin = self._parseUtc(DATE_OBS)
         end = begin + timedelta(seconds=EXPTIME)
 
         meta = Metadata(
@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta, timezone
+from datetime import timedelta
 
 from upload.process_uploads.header_standardizer import HeaderStandardizer
 from upload.models import Metadata
@@ -52,8 +52,7 @@ class LowellStandardizer(HeaderStandardizer):
         """
         DATEOBS = self.header["DATE-OBS"]
         EXP = self.header["EXPTIME"]
-        begin = datetime.strptime(DATEOBS, "%Y-%m-%dT%H:%M:%S.%f")
-        begin = begin.replace(tzinfo=timezone.utc)
+        begin = self._parseUtc(DATEOBS)
         end = begin + timedelta(seconds=EXP)
 
         meta = Metadata(
@@ -2,9 +2,7 @@
 Class that facilitates header metadata translation for MOA-II instrument
 """
 
-from datetime import timezone
-
-from astropy.time import Time
+from datetime import datetime, timedelta, timezone
 
 from upload.process_uploads.header_standardizer import HeaderStandardizer
 from upload.models import Metadata
@@ -18,6 +16,9 @@ class MoaStandardizer(HeaderStandardizer):
     name = "moa_standardizer"
     priority = 1
 
+    mjdEpoch = datetime(1858, 11, 17, tzinfo=timezone.utc)
+    """Modified Julian Date epoch, i.e. JD 2400000.5, in UTC."""
+
     def __init__(self, header, **kwargs):
         super().__init__(header, **kwargs)
 
@@ -28,6 +29,23 @@ class MoaStandardizer(HeaderStandardizer):
             return True
         return False
 
+    @classmethod
+    def _jdToUtc(cls, jd):
+        """Converts a Julian Date in the UTC time scale to a timezone aware
+        datetime.
+
+        Parameters
+        ----------
+        jd : `float`
+            Julian Date.
+
+        Returns
+        -------
+        utc : `datetime.datetime`
+            Timezone aware datetime in UTC.
+        """
+        return cls.mjdEpoch + timedelta(days=jd - 2400000.5)
+
     def standardizeMetadata(self):
         run = self.header["RUN"].strip()
         field = self.header["FIELD"].strip()
@@ -39,18 +57,11 @@ class MoaStandardizer(HeaderStandardizer):
         # There is a timesys key but I have no idea how to generically instantiate
         # timezone aware datetime and astropy Time seems not to work well with
         # Django - the astrometadata is also broken!
-        if "UTC" in self.header["TIMESYS"].upper():
-            tzinfo = timezone.utc
-        else:
+        if "UTC" not in self.header["TIMESYS"].upper():
             raise ValueError("Can not recognize time scale system that is used?")
 
-        jdstart = Time(self.header["JDSTART"], format="jd", scale="utc")
-        jdstart = jdstart.utc.datetime
-        jdstart = jdstart.replace(tzinfo=tzinfo)
-
-        jdend = Time(self.header["JDSTART"], format="jd", scale="utc")
-        jdend = jdend.utc.datetime
-        jdend = jdend.replace(tzinfo=tzinfo)
+        jdstart = self._jdToUtc(self.header["JDSTART"])
+        jdend = self._jdToUtc(self.header["JDEND"])
 
         # TODO: filter out what is the filter standardization here?
         meta = Metadata(
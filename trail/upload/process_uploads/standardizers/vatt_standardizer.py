@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta, timezone
+from datetime import timedelta
 
 from upload.process_uploads.header_standardizer import HeaderStandardizer
 from upload.models import Metadata
@@ -9,6 +9,10 @@ import re
 __all__ = ["VattStandardizer", ]
 
 
+_FILTER_RE = re.compile(r'Filter(.*)')
+"""Matches the header comment line naming the filter, captures the name."""
+
+
 class VattStandardizer(HeaderStandardizer):
     """
     Class that facilitates header metadata translation for the Vatican Observatory
@@ -58,18 +62,13 @@ class VattStandardizer(HeaderStandardizer):
         TIME = self.header["TIME-OBS"]
         DATEOBS = DATE + 'T' + TIME
         EXP = self.header["EXPTIME"]
-        begin = datetime.strptime(DATEOBS, "%Y-%m-%dT%H:%M:%S.%f")
-        begin = begin.replace(tzinfo=timezone.utc)
+        begin = self._parseUtc(DATEOBS)
         end = begin + timedelta(seconds=EXP)
 
         # The following logic will search the comments of the
         # header file to find the filter used in the telescope
-        expr = re.compile(r'Filter(.*)')
         comment = str(self.header['COMMENT']).split('\n')
-        matches = []
-        for line in comment:
-            if expr.match(line) is not None:
-                matches.append(expr.match(line).groups()[0])
+        matches = [m.group(1) for line in comment if (m := _FILTER_RE.match(line))]
 
         if len(matches) == 1:
             FILTER = matches[0].strip()
@@ -55,9 +55,16 @@ class UploadProcessor(ABC):
     processors = dict()
     """All registered upload processing classes."""
 
+    _extensionIndex = dict()
+    """Registered processors indexed by the file extensions they declare,
+    each list is sorted by descending priority."""
+
     name = None
     """Processor's name. Only named processors will be registered."""
 
+    extensions = []
+    """File extensions the processor can handle."""
+
     priority = 0
     """Priority. Processors with high priority are prefered over processors
     with low priority when processing an upload.
@@ -75,6 +82,10 @@ class UploadProcessor(ABC):
         if name and name is not None:
             super().__init_subclass__(**kwargs)
             UploadProcessor.processors[cls.name] = cls
+            for ext in cls.extensions:
+                candidates = UploadProcessor._extensionIndex.setdefault(ext, [])
+                candidates.append(cls)
+                candidates.sort(key=lambda proc: proc.priority, reverse=True)
 
     @classmethod
     @abstractmethod
@@ -124,28 +135,23 @@ class UploadProcessor(ABC):
         -------
         processor : `cls`
             Processor class that can process the given upload.
+
+        Raises
+        ------
+        ValueError
+            None of the registered processors can process the upload.
         """
-        processors = []
-        for processor in cls.processors.values():
+        # Only processors declaring the upload's extension are probed, in
+        # order of priority, and the first capable one is selected.
+        candidates = cls._extensionIndex.get(uploadedFile.extension.lower(), [])
+        for processor in candidates:
             if processor.canProcess(uploadedFile):
-                processors.append(processor)
-
-        def get_priority(processor):
-            """Return processors priority."""
-            return processor.priority
-        processors.sort(key=get_priority, reverse=True)
-
-        if processors:
-            if len(processors) > 1:
-                # I think this should never be an issue really, but just in case
-                names = [proc.name for proc in processors]
-                logger.info("Multiple processors declared ability to process "
-                            f"the given upload: {names}. Using {names[-1]} "
-                            "to process FITS.")
-            return processors[0]
-        else:
-            raise ValueError("None of the known processors can handle this upload.\n "
-                             f"Known processors: {list(cls.processors.keys())}")
+                return processor
+
+        # probing processors may have opened the file, nothing will close it
+        uploadedFile.close()
+        raise ValueError("None of the known processors can handle this upload.\n "
+                         f"Known processors: {list(cls.processors.keys())}")
 
     @classmethod
     def fromFileWrapper(cls, uploadedFile, ip=None):
@@ -1,4 +1,6 @@
 import os.path
+import shutil
+from functools import cached_property
 from pathlib import Path
 
 from django.conf import settings
@@ -27,9 +29,18 @@ class TemporaryUploadedFileWrapper:
     special_extensions = {".gz", ".bz2", ".xz", ".fz"}
     """File extensions recognized as processable archives."""
 
+    copy_buffer_size = 1024 * 1024
+    """Size, in bytes, of the buffer used to copy the upload to its save
+    location."""
+
+    hdulist = None
+    """FITS file opened from the upload, shared by all processors inspecting
+    it, see `FitsProcessor._openFits`. `None` when not opened."""
+
     def __init__(self, upload):
         self.tmpfile = upload
         self.filename = upload.name
+        self._suffixes = Path(upload.name).suffixes
 
     def __repr__(self):
         repr = super().__repr__()
@@ -37,6 +48,37 @@ class TemporaryUploadedFileWrapper:
         return f"{clsPath}{self.__class__.__name__}({self.filename})>"
 
     @property
+    def filepath(self):
+        """Path to the temporary file backing the upload, or `None` when the
+        upload is held in memory.
+        """
+        getPath = getattr(self.tmpfile, "temporary_file_path", None)
+        return None if getPath is None else getPath()
+
+    @property
+    def source(self):
+        """Location the uploaded data can be read from, without copying it.
+
+        Returns the path to the temporary file backing the upload when one
+        exists, and the rewound upload file object otherwise. Suitable for
+        readers accepting both paths and file-like objects, f.e.
+        `astropy.io.fits.open`.
+        """
+        filepath = self.filepath
+        if filepath is not None:
+            return filepath
+        self.tmpfile.seek(0)
+        return self.tmpfile
+
+    def close(self):
+        """Closes the FITS file opened from the upload, if any, and releases
+        its memory mapped data.
+        """
+        if self.hdulist is not None:
+            self.hdulist.close()
+            self.hdulist = None
+
+    @cached_property
     def extension(self):
         """File extension that respects most popularly used archive and
         compressed archive extensions.
@@ -52,8 +94,7 @@ class TemporaryUploadedFileWrapper:
         If the names of uploaded files are `image.fits.tar.bz2`, `image.fits`
         and `image``returns `.fits.tar.bz2`, `.fits` and ``.
         """
-        fname = Path(self.filename)
-        extensions = fname.suffixes
+        extensions = self._suffixes
         if not extensions:
             return ""
 
@@ -63,9 +104,9 @@ class TemporaryUploadedFileWrapper:
             return "".join(extensions)
 
         # otherwise just the last one
-        return extensions.pop()
+        return extensions[-1]
 
-    @property
+    @cached_property
     def basename(self):
         """Name of the uploaded file without extensions.
 
@@ -85,12 +126,12 @@ class TemporaryUploadedFileWrapper:
             Root of the path where the file will be saved.
         """
         # TODO: fix os.path when transitioning to S3
-        if root is None:
-            tgtPath = os.path.join(self.save_root, self.filename)
-        else:
-            tgtPath = os.path.join(self.save_root, self.filename)
+        root = self.save_root if root is None else root
+        tgtPath = os.path.join(root, self.filename)
 
+        # stream in chunks, uploads can be several hundred MB large
+        self.tmpfile.seek(0)
         with open(tgtPath, "wb") as f:
-            f.write(self.tmpfile.read())
+            shutil.copyfileobj(self.tmpfile, f, self.copy_buffer_size)
 
         return tgtPath
@@ -87,6 +87,11 @@ class WcsTestCase(TestCase):
         # for Wcs these are all of the keys
         self.assertCountEqual(self.wcs1.required_keys, list(TestData.wcs1.keys()))
 
+    def testFromDictSubset(self):
+        """Tests Wcs instantiation from a superset of its keys."""
+        wcs = Wcs.fromDictSubset(dict(TestData.metadata1, **TestData.wcs1))
+        self.assertEqual(wcs.toDict(), TestData.wcs1)
+
     def testIsClose(self):
         """Test Wcs approximate equality."""
         self.assertTrue(self.wcs1.isClose(self.wcs2))
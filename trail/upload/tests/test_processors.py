@@ -1,15 +1,25 @@
+import io
 import os
 import shutil
 import tempfile
+from datetime import datetime, timedelta, timezone
+from unittest import mock
 
+import numpy as np
 import yaml
+from PIL import Image, ImageOps
+from astropy import visualization as aviz
+from astropy.time import Time
 
 from django.test import TestCase
 
-from upload.models import StandardizedHeader, Thumbnails
+from upload.models import StandardizedHeader, Thumbnails, Wcs
 from upload.process_uploads.upload_wrapper import TemporaryUploadedFileWrapper
 from upload.process_uploads.upload_processor import UploadProcessor
 from upload.process_uploads.fits_processor import FitsProcessor
+from upload.process_uploads.processors.decam_processor import DecamFits, DecamFocalPlane
+from upload.process_uploads.processors.lbt_processor import LbtConstants
+from upload.process_uploads.standardizers.moa_standardizer import MoaStandardizer
 import upload.process_uploads.header_standardizer as header_standardizer
 
 
@@ -35,15 +45,30 @@ class MockTmpUploadedFile:
         self.name = fname
         self._sourcePath = sourcePath
         self.sourceFilePath = os.path.join(sourcePath, fname)
+        self._pos = 0
 
-    def read(self):
+    def read(self, size=-1):
         with open(self.sourceFilePath, "rb") as f:
-            return f.read()
+            f.seek(self._pos)
+            data = f.read(size)
+        self._pos += len(data)
+        return data
+
+    def seek(self, pos):
+        self._pos = pos
 
     def temporary_file_path(self):
         return self.sourceFilePath
 
 
+class MockInMemoryUploadedFile(io.BytesIO):
+    """Mocks an upload held in memory, i.e. one without a temporary file."""
+    def __init__(self, fname, sourcePath=""):
+        with open(os.path.join(sourcePath, fname), "rb") as f:
+            super().__init__(f.read())
+        self.name = fname
+
+
 class TestAstrometryNet(TestCase):
     """Tests the astrometry.net functionality"""
     testDataDir = os.path.join(TESTDIR, "data")
@@ -67,6 +92,55 @@ class TestAstrometryNet(TestCase):
                           path_to_file=test_file)
 
 
+class ParseUtcTestCase(TestCase):
+    """Tests parsing of header timestamps."""
+
+    def setUp(self):
+        header_standardizer.HeaderStandardizer._parseUtc.cache_clear()
+
+    def testParse(self):
+        """Tests fractional, whole second and Z suffixed timestamps parse to
+        timezone aware UTC datetimes."""
+        timestamps = {
+            "2021-01-17T14:35:11.5": datetime(2021, 1, 17, 14, 35, 11, 500000),
+            "2021-04-07T12:03:57.256": datetime(2021, 4, 7, 12, 3, 57, 256000),
+            "2020-03-06T03:12:00.123456": datetime(2020, 3, 6, 3, 12, 0, 123456),
+            "2020-12-09T12:33:40": datetime(2020, 12, 9, 12, 33, 40),
+            "2020-12-09T12:33:40Z": datetime(2020, 12, 9, 12, 33, 40),
+            "2020-12-09T12:33:40.25Z": datetime(2020, 12, 9, 12, 33, 40, 250000),
+        }
+        for timestamp, expected in timestamps.items():
+            with self.subTest(timestamp=timestamp):
+                parsed = header_standardizer.HeaderStandardizer._parseUtc(timestamp)
+                self.assertEqual(parsed, expected.replace(tzinfo=timezone.utc))
+                self.assertEqual(parsed.tzinfo, timezone.utc)
+
+    def testInvalid(self):
+        """Tests malformed timestamps raise."""
+        with self.assertRaises(ValueError):
+            header_standardizer.HeaderStandardizer._parseUtc("2020-12-09 at noon")
+
+    def testCache(self):
+        """Tests repeated timestamps are parsed only once."""
+        parseUtc = header_standardizer.HeaderStandardizer._parseUtc
+        first = parseUtc("2021-01-17T14:35:11.5")
+        second = parseUtc("2021-01-17T14:35:11.5")
+        self.assertIs(first, second)
+        self.assertEqual(parseUtc.cache_info().hits, 1)
+
+
+class JulianDateTestCase(TestCase):
+    """Tests conversion of Julian Dates in MOA headers."""
+
+    def testJdToUtc(self):
+        """Tests Julian Dates convert to the same UTC datetimes as astropy."""
+        for jd in (2459193.02338, 2459193.026854, 2451545.0, 2440587.5):
+            expected = Time(jd, format="jd", scale="utc").utc.datetime.replace(tzinfo=timezone.utc)
+            with self.subTest(jd=jd):
+                self.assertAlmostEqual(MoaStandardizer._jdToUtc(jd), expected,
+                                       delta=timedelta(microseconds=100))
+
+
 class TemporaryUploadedFileWrapperTestCase(TestCase):
     """Tests the TemporaryUploadedFileWrapper functionality. """
     testDataDir = os.path.join(TESTDIR, "data")
@@ -119,6 +193,21 @@ class TemporaryUploadedFileWrapperTestCase(TestCase):
         self.assertEqual(tgtPath, expected)
         self.assertTrue(os.path.exists(tgtPath))
 
+    def testSaveToRoot(self):
+        """Verify the whole upload is copied to the given root, in chunks and
+        regardless of how much of it was already read."""
+        fits = self.fits[0]
+        with open(fits.tmpfile.sourceFilePath, "rb") as f:
+            expected = f.read()
+
+        fits.tmpfile.read(100)
+        fits.copy_buffer_size = 1000
+        with tempfile.TemporaryDirectory(dir=self.tmpTestDir) as root:
+            tgtPath = fits.save(root)
+            self.assertEqual(tgtPath, os.path.join(root, fits.filename))
+            with open(tgtPath, "rb") as f:
+                self.assertEqual(f.read(), expected)
+
 
 class UploadProcessorTestCase(TestCase):
     """Tests the internal logic of FitsProcessor."""
@@ -161,6 +250,69 @@ class UploadProcessorTestCase(TestCase):
             with self.subTest(fitsname=fits.filename):
                 self.assertEqual(fitsProcessor.name, expected["metadata"]["processor_name"])
 
+    def testCloseReleasesFits(self):
+        """Tests closing a processor closes the shared FITS file, and that
+        the next processor reopens it."""
+        fits = self.fits[0]
+        fitsProcessor = UploadProcessor.fromFileWrapper(fits)
+        self.assertIs(fits.hdulist, fitsProcessor.hdulist)
+
+        fitsProcessor.close()
+        self.assertIsNone(fits.hdulist)
+
+        reopened = UploadProcessor.fromFileWrapper(fits)
+        self.assertIsNot(reopened.hdulist, fitsProcessor.hdulist)
+        reopened.close()
+
+    def testProcess(self):
+        """Tests processing stores every thumbnail linked to one of the
+        stored WCSs of the upload."""
+        # an upload for every processor; Las Cumbres, LBT and HSC images are
+        # BZERO scaled and are not memory mapped
+        fnames = ("cutout_bi327715.fits", "cutout_c4d_200306_000415_ori.fits.fz",
+                  "cutout_lbcb.20210407.120357.fits", "cutout_HSCA21787010.fits",
+                  "cutout_calexp-0941420_23.fits")
+        for fname in fnames:
+            data = MockTmpUploadedFile(fname, self.testDataDir)
+            fits = TemporaryUploadedFileWrapper(data)
+            result = UploadProcessor.fromFileWrapper(fits).process()
+
+            wcsIds = set(Wcs.objects.filter(metadata=result.metadata).values_list("id", flat=True))
+            with self.subTest(fitsname=fname):
+                self.assertEqual(len(wcsIds), len(result.wcs))
+                for thumb in result.thumbnails:
+                    stored = Thumbnails.objects.get(pk=thumb.pk)
+                    self.assertIsNotNone(stored.wcs_id)
+                    self.assertIn(stored.wcs_id, wcsIds)
+
+    def testProcessClosesOnError(self):
+        """Tests the FITS file is closed when processing fails."""
+        fits = self.fits[0]
+        fitsProcessor = UploadProcessor.fromFileWrapper(fits)
+        with mock.patch.object(fitsProcessor, "createThumbnails", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                fitsProcessor.process()
+        self.assertIsNone(fits.hdulist)
+
+    def testInMemoryUpload(self):
+        """Tests uploads held in memory are read without a temporary file and
+        that they fail clearly when their WCS requires astrometry.net."""
+        for fname in ("cutout_bi327715.fits", "cutout_c4d_200306_000415_ori.fits.fz"):
+            fits = TemporaryUploadedFileWrapper(MockInMemoryUploadedFile(fname, self.testDataDir))
+            fitsProcessor = UploadProcessor.fromFileWrapper(fits)
+            expected = StandardizedHeader.fromDict(self.standardizedAnswers[fname])
+            with self.subTest(fitsname=fname):
+                self.assertIsNone(fits.filepath)
+                self.assertEqual(fitsProcessor.standardizeHeader(), expected)
+            fitsProcessor.close()
+
+        # MOA headers carry no WCS
+        data = MockInMemoryUploadedFile("cutout_A3671-C2018_F4-R-3.fit", self.testDataDir)
+        fitsProcessor = UploadProcessor.fromFileWrapper(TemporaryUploadedFileWrapper(data))
+        with self.assertRaises(header_standardizer.StandardizeWcsException):
+            fitsProcessor.standardizeWcs()
+        fitsProcessor.close()
+
     def testStandardize(self):
         """Tests whether WCS and Header Metadata are standardized as expected."""
         for fits in self.fits:
@@ -191,6 +343,73 @@ class UploadProcessorTestCase(TestCase):
         fitsProcessor = UploadProcessor.fromFileWrapper(fits)
         fitsProcessor.standardizeHeader()
 
+    def testFocalPlaneThumbnails(self):
+        """Tests DECam and LBT focal plane thumbnails are assembled at the
+        expected sizes."""
+        data = MockTmpUploadedFile("cutout_c4d_200306_000415_ori.fits.fz", self.testDataDir)
+        decam = UploadProcessor.fromFileWrapper(TemporaryUploadedFileWrapper(data))
+        xdim, ydim = decam.exts[0].header["NAXIS2"], decam.exts[0].header["NAXIS1"]
+        largeShape = DecamFocalPlane(4, (xdim, ydim)).planeShape
+        smallShape = DecamFocalPlane(10, (xdim, ydim)).planeShape
+
+        data = MockTmpUploadedFile("cutout_lbcb.20210407.120357.fits", self.testDataDir)
+        lbt = UploadProcessor.fromFileWrapper(TemporaryUploadedFileWrapper(data))
+        dim = LbtConstants()
+
+        expected = {
+            decam: (largeShape[::-1], smallShape[::-1]),
+            lbt: ((int(dim.focx/4), int(dim.focy/4)), (int(dim.focx/10), int(dim.focy/10))),
+        }
+        for processor, (largeSize, smallSize) in expected.items():
+            thumb = processor.createThumbnails()
+            with self.subTest(processor=processor.name):
+                with Image.open(thumb.largeAbsPath) as large:
+                    self.assertEqual(large.size, largeSize)
+                with Image.open(thumb.smallAbsPath) as small:
+                    self.assertEqual(small.size, smallSize)
+            processor.close()
+
+    def testLbtFocalPlaneLayout(self):
+        """Tests LBT CCDs are placed where, and in the orientation, the full
+        resolution focal plane was originally assembled, and that downsampled
+        planes are block averages of it."""
+
+        class SmallLbtConstants(LbtConstants):
+            fill = 2
+            ccdx = 8
+            ccdy = 16
+            focx = 3*ccdx + 2*fill
+            focy = ccdy + fill + ccdx
+
+        data = MockTmpUploadedFile("cutout_lbcb.20210407.120357.fits", self.testDataDir)
+        lbt = UploadProcessor.fromFileWrapper(TemporaryUploadedFileWrapper(data))
+        dim = SmallLbtConstants()
+        rng = np.random.default_rng(42)
+        ccds = {slot: rng.normal(size=(dim.ccdy, dim.ccdx)) for slot in (0, 1, 2, 3)}
+
+        # the original full resolution assembly, in display orientation
+        expected = np.zeros((dim.focy, dim.focx), dtype=np.uint8)
+        for slot, ccd in ccds.items():
+            ccd = lbt._histogramEqualize(ccd, 255, np.uint8)
+            if slot == 1:
+                expected[-dim.ccdy:, -dim.ccdx:] = ccd[::-1]
+            elif slot == 2:
+                expected[-dim.ccdy:, dim.ccdx+dim.fill:2*dim.ccdx+dim.fill] = ccd[::-1]
+            elif slot == 3:
+                expected[-dim.ccdy:, :dim.ccdx] = ccd[::-1]
+            else:
+                start = int(dim.ccdx/2) + dim.fill
+                expected[:dim.ccdx, start:start+dim.ccdy] = np.flip(ccd).T
+
+        for scaling in (1, 2):
+            img = np.zeros((int(dim.focy/scaling), int(dim.focx/scaling)), dtype=np.uint8)
+            for slot, ccd in ccds.items():
+                lbt._placeCcd(img, ccd, slot, dim, scaling)
+            with self.subTest(scaling=scaling):
+                reference = expected if scaling == 1 else lbt._blockMean(expected, scaling)
+                np.testing.assert_array_equal(img, reference)
+        lbt.close()
+
     def testStoreThumbnails(self):
         """Tests whether two thumbnails appear at the expected location."""
         data = MockTmpUploadedFile("cutout_frame-i-008108-5-0025.fits",
@@ -203,3 +422,121 @@ class UploadProcessorTestCase(TestCase):
         small = os.path.join(self.tmpTestDir, fits.basename+'_small.jpg')
         self.assertTrue(os.path.exists(large))
         self.assertTrue(os.path.exists(small))
+
+
+class HistogramEqualizationTestCase(TestCase):
+    """Tests the histogram equalization used to normalize thumbnails."""
+
+    def setUp(self):
+        # a smooth image without large flat areas, so a strided subsample
+        # represents its histogram well
+        y, x = np.mgrid[:1000, :1000]
+        self.image = x + 300*np.sin(y/50)
+
+    def testFullHistogramParity(self):
+        """Tests equalization is within one level of the full histogram
+        equalization, with and without subsampling the pixels."""
+        for size in (400, 1000):
+            image = self.image[:size, :size]
+            stretch = aviz.HistEqStretch(image)
+            expected = np.asarray(aviz.ImageNormalize(image, stretch=stretch, clip=True)(image))
+            produced = FitsProcessor.normalizeImage(image)
+            with self.subTest(size=size):
+                self.assertEqual(produced.dtype, np.float32)
+                self.assertLessEqual(np.abs(produced - expected).max(), 1/255)
+
+    def testConstantImage(self):
+        """Tests a constant image equalizes to a single level."""
+        produced = FitsProcessor._histogramEqualize(np.full((50, 50), 7.0), 255, np.uint8)
+        self.assertEqual(len(np.unique(produced)), 1)
+
+    def testNonFiniteImage(self):
+        """Tests NaN and infinite pixels don't prevent the equalization."""
+        produced = FitsProcessor.normalizeImage(np.full((50, 50), np.nan))
+        self.assertTrue(np.isfinite(produced).all())
+        self.assertTrue((produced == 0).all())
+
+        image = self.image[:100, :100].copy()
+        image[0, 0], image[0, 1], image[0, 2] = np.inf, -np.inf, np.nan
+        produced = FitsProcessor.normalizeImage(image)
+        finite = produced[np.isfinite(image)]
+        self.assertTrue(np.isfinite(produced).all())
+        self.assertEqual(produced[0, 0], finite.max())
+        self.assertEqual(produced[0, 1], finite.min())
+        self.assertEqual(produced[0, 2], finite.min())
+
+    def testIntegerImages(self):
+        """Tests integer images equalize the same as their float values."""
+        images = {
+            "uint8": (self.image[:300, :300] % 256).astype(np.uint8),
+            "int16": (self.image[:300, :300]*40 - 20000).astype(np.int16),
+        }
+        for dtype, image in images.items():
+            expected = FitsProcessor._histogramEqualize(image.astype(np.float64), 255, np.uint8)
+            produced = FitsProcessor._histogramEqualize(image, 255, np.uint8)
+            with self.subTest(dtype=dtype):
+                np.testing.assert_array_equal(produced, expected)
+
+
+class DecamNormalizationTestCase(TestCase):
+    """Tests normalization of DECam CCD images."""
+
+    def testSmallIntegerImages(self):
+        """Tests 8 and 16 bit integer images normalize exactly like they do
+        through the floating point path."""
+        rng = np.random.default_rng(42)
+        for dtype in (np.uint8, np.int8, np.uint16, np.int16):
+            limits = np.iinfo(dtype)
+            center, spread = (int(limits.min) + int(limits.max))/2, (int(limits.max) - int(limits.min))/10
+            image = np.clip(rng.normal(center, spread, (200, 300)), limits.min, limits.max).astype(dtype)
+
+            avg, std = image.mean(dtype=np.float32), image.std(dtype=np.float32)
+            lo, hi = avg - 0.5*std, avg + 0.5*std
+            scaled = DecamFits._clipAndRescale(image, lo, hi, np.empty(image.shape, dtype=np.float32))
+            expected = DecamFits._equalizationLut(np.bincount(scaled.ravel(), minlength=256))[scaled]
+
+            with self.subTest(dtype=np.dtype(dtype).name):
+                np.testing.assert_array_equal(DecamFits.normalizeImage(image), expected)
+
+    def testEqualizationLut(self):
+        """Tests the equalization lookup table reproduces PIL's equalize."""
+        rng = np.random.default_rng(42)
+        images = {
+            "normal": np.clip(rng.normal(100, 30, (200, 300)), 0, 255).astype(np.uint8),
+            "uniform": rng.integers(0, 256, (200, 300), dtype=np.uint8),
+            "two levels": np.where(rng.random((200, 300)) > 0.3, 10, 200).astype(np.uint8),
+            "constant": np.full((20, 30), 42, dtype=np.uint8),
+        }
+        for name, image in images.items():
+            expected = np.asarray(ImageOps.equalize(Image.fromarray(image, "L")))
+            lut = DecamFits._equalizationLut(np.bincount(image.ravel(), minlength=256))
+            with self.subTest(image=name):
+                np.testing.assert_array_equal(lut[image], expected)
+
+    def testFocalPlaneLayout(self):
+        """Tests CCDs are placed where, and in the orientation, the focal
+        plane was originally assembled, before it was transposed for display.
+        """
+        rng = np.random.default_rng(42)
+        plane = DecamFocalPlane(4, (64, 32))
+        sizeX, sizeY = plane.scaledX, plane.scaledY
+        gappedX, gappedY = sizeX + plane.scaledGap, sizeY + plane.scaledGap
+
+        expected = np.zeros((plane.nRows*gappedX, plane.nCols*gappedY), dtype=np.uint8)
+        for label in plane.detector_labels:
+            detector = plane.detectors[label]
+            startX = detector.row*gappedX
+            if detector.rowType == "odd":
+                startX += int(sizeX/2)
+            startY = detector.col*gappedY
+
+            ccd = rng.integers(1, 256, (sizeX, sizeY), dtype=np.uint8)
+            expected[startX:startX+sizeX, startY:startY+sizeY] = ccd
+            plane.add_image(ccd, label)
+
+        expected = expected.T
+        height, width = plane.planeImage.shape
+        np.testing.assert_array_equal(plane.planeImage, expected[:height, :width])
+        # the plane only drops the trailing gaps
+        self.assertFalse(expected[height:].any())
+        self.assertFalse(expected[:, width:].any())